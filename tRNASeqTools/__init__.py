@@ -4,7 +4,6 @@
 import os
 import sys
 import copy
-import pkg_resources
 
 # Make sure the Python environment hasn't changed since the installation
 try:
@@ -23,6 +22,12 @@ D = {
              'required': True,
              'help': "tRNA-seq-tools profile database"}
                 ),
+    'profile-dbs': (
+            ['profile_dbs'],
+            {'metavar': "PROFILE_DB",
+             'nargs': '+',
+             'help': "tRNA-seq-tools profile database(s)"}
+                ),
     'output-file': (
             ['-o', '--output-file'],
             {'metavar': 'FILE_PATH',
@@ -83,15 +88,19 @@ run = terminal.Run()
 def set_version():
     tRNASeqTools_version = 'unknown'
 
+    # this runs every time any of the programs starts, so the setup.py is read
+    # first if it is being run from the codebase dir, and the package metadata
+    # is looked up (which is not cheap either) only if there is no setup.py.
+    # pkg_resources is not used at all, since importing it alone takes longer
+    # than most of the programs take to run
+    setup_py_path = os.path.normpath(os.path.dirname(os.path.abspath(__file__))) + '/../setup.py'
     try:
-        tRNASeqTools_version = pkg_resources.require("tRNASeqTools")[0].version
+        version_string = [l.strip() for l in open(setup_py_path).readlines() if l.strip().startswith('tRNASeqTools_version')][0]
+        tRNASeqTools_version = version_string.split('=')[1].strip().strip("'").strip('"')
     except:
-        # maybe anvi'o is not installed but it is being run from the codebase dir?
-        # some hacky stuff to get version from the setup.py
         try:
-            setup_py_path = os.path.normpath(os.path.dirname(os.path.abspath(__file__))) + '/../setup.py'
-            version_string = [l.strip() for l in open(setup_py_path).readlines() if l.strip().startswith('tRNASeqTools_version')][0]
-            tRNASeqTools_version = version_string.split('=')[1].strip().strip("'").strip('"')
+            import importlib.metadata
+            tRNASeqTools_version = importlib.metadata.version("tRNASeqTools")
         except:
             pass
 
@@ -16,6 +16,10 @@ __maintainer__ = "Steven Cui"
 __email__ = "stevencui729@gmail.com"
 
 
+# rows are fetched from SQLite this many at a time when iterating over them
+ROW_BATCH_SIZE = 10000
+
+
 class DB:
     """This class handles basic database functions."""
 
@@ -24,6 +28,10 @@ class DB:
         self.db_path = db_path
         self.version = None
 
+        # when False, statements are not committed one by one, and it is up to
+        # the client to call commit()
+        self.autocommit = True
+
         if new_database:
             filesnpaths.is_output_file_writable(db_path)
         else:
@@ -45,8 +53,8 @@ class DB:
                 raise ConfigError("It seems the database '%s' was generated when your client was at version %s,\
                                     however, your client now is at version %s. Which means this database file\
                                     cannot be used with this client anymore and needs to be upgraded to the\
-                                    version %s :/"\
-                                            % (self.db_path, self.version, client_version, client_version, self.version))
+                                    version %s :/ (which 'trna-migrate-db' can do for you)"\
+                                            % (self.db_path, self.version, client_version, client_version))
 
 
     def set_version(self, version):
@@ -54,6 +62,34 @@ class DB:
         self.commit()
 
 
+    def upgrade(self, client_version, migrations):
+        """Upgrades the database to `client_version` one version at a time.
+        `migrations` maps each version to a function that takes this instance
+        and turns its contents into the next version. Each step happens in a
+        single transaction, so a failed step leaves the database as it was."""
+        version = int(self.version)
+
+        while version < int(client_version):
+            if version not in migrations:
+                raise ConfigError("Nobody knows how to upgrade the database '%s' from version %d :/" % (self.db_path, version))
+
+            self.autocommit = False
+            self.cursor.execute('BEGIN')
+            try:
+                migrations[version](self)
+                self.update_meta_value('version', version + 1)
+                self.commit()
+            except:
+                self.conn.rollback()
+                raise
+            finally:
+                self.autocommit = True
+
+            version += 1
+
+        self.version = version
+
+
     def get_version(self):
         try:
             return self.get_meta_value('version')
@@ -63,12 +99,19 @@ class DB:
 
     def set_stat_value(self, key, value):
         self._exec('''INSERT INTO stats VALUES(?,?)''', (key, value,))
-        self.commit()
+
+
+    def set_stat_values(self, stats_dict):
+        """Inserts all key/value pairs in `stats_dict` into the stats table at once."""
+        self._exec_many('''INSERT INTO stats VALUES(?,?)''', list(stats_dict.items()))
 
 
     def set_meta_value(self, key, value):
         self._exec('''INSERT INTO self VALUES(?,?)''', (key, value,))
-        self.commit()
+
+
+    def update_meta_value(self, key, value):
+        self._exec('''UPDATE self SET value = ? WHERE key = ?''', (value, key,))
 
 
     def get_meta_value(self, key):
@@ -92,7 +135,11 @@ class DB:
 
 
     def _exec_many(self, sql_query, values):
-        return self.cursor.executemany(sql_query, values)
+        return_val = self.cursor.executemany(sql_query, values)
+
+        if self.autocommit:
+            self.commit()
+        return return_val
 
 
     def _exec(self, sql_query, value=None):
@@ -104,20 +151,38 @@ class DB:
         else:
             return_val = self.cursor.execute(sql_query)
 
-        self.commit()
+        if self.autocommit:
+            self.commit()
         return return_val
 
 
+    def begin_bulk_load(self):
+        """Trades durability for speed while a new database is being populated:
+        nothing is committed until the client says so, and there is no journal
+        or fsync to wait for. The journal is turned off rather than put into WAL
+        mode, since WAL does not work on network file systems."""
+        self.commit()
+        self.autocommit = False
+        self.cursor.execute('PRAGMA journal_mode = OFF')
+        self.cursor.execute('PRAGMA synchronous = OFF')
+
+
+    def end_bulk_load(self):
+        """Commits everything, and goes back to the default, safe settings."""
+        self.commit()
+        self.cursor.execute('PRAGMA journal_mode = DELETE')
+        self.cursor.execute('PRAGMA synchronous = FULL')
+        self.autocommit = True
+
+
     def create_self(self):
         """Creates an empty default table."""
         self._exec("""CREATE TABLE self (key text, value text)""")
-        self.commit()
 
 
     def create_stats(self):
         """Creates an empty stats table."""
         self._exec("""CREATE TABLE stats (key text, value numeric)""")
-        self.commit()
 
 
     def create_table(self, table_name, fields, types):
@@ -129,18 +194,55 @@ class DB:
 
         self._exec("""CREATE TABLE IF NOT EXISTS %s (%s)""" % (table_name, db_fields))
 
-        self.commit()
+
+    def create_index(self, index_name, table_name, columns, where_clause=None):
+        """Creates an index on `columns` (a comma-separated string) of a table.
+        With a `where_clause`, only the rows that satisfy it are indexed."""
+        self._exec("""CREATE INDEX IF NOT EXISTS %s ON %s (%s)%s""" % (index_name, table_name, columns,
+                                                                          ' WHERE %s' % where_clause if where_clause else ''))
+
+
+    def iter_rows(self, table, columns=None, batch_size=ROW_BATCH_SIZE):
+        """Yields the rows of a table (or only the `columns` of them) as tuples."""
+        return self.iter_rows_where(table, None, columns=columns, batch_size=batch_size)
+
+
+    def iter_rows_where(self, table, where_clause, values=(), columns=None, batch_size=ROW_BATCH_SIZE):
+        """Yields the rows of a table that satisfy the where-clause (with `values`
+        bound to its '?' parameters) as tuples, `batch_size` rows at a time from
+        SQLite, so only that many rows are ever in memory. Rows come from a
+        cursor of their own, so other queries can run while they are consumed."""
+        query = """SELECT %s FROM %s""" % (', '.join(columns) if columns else '*', table)
+        if where_clause:
+            query += """ WHERE %s""" % where_clause
+
+        return self.iter_query(query, values, batch_size)
+
+
+    def iter_query(self, query, values=(), batch_size=ROW_BATCH_SIZE):
+        """Yields the rows a query returns, the same way `iter_rows_where` does."""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query, values)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
 
 
     def get_all_rows_from_table(self, table):
         """Get all the rows from a table as a list."""
-        result = self._exec("""SELECT * FROM %s""" % table)
-        return result.fetchall()
+        return list(self.iter_rows(table))
 
 
     def get_table_structure(self, table):
         """Get the headers of a table as a list."""
-        result = self._exec("""SELECT * FROM %s""" % table)
+        result = self._exec("""SELECT * FROM %s LIMIT 0""" % table)
         return [t[0] for t in result.description]
 
 
@@ -150,7 +252,7 @@ class DB:
         """Returns a table's entire contents as a dict."""
 
         results_dict = {}
-        rows = self.get_all_rows_from_table(table)
+        rows = self.iter_rows(table)
 
         if not table_structure:
             table_structure = self.get_table_structure(table)
@@ -186,8 +288,7 @@ class DB:
         """
 
         results_dict = {}
-        rows = self._exec("""SELECT * FROM %s WHERE %s""" % (table,
-            where_clause)).fetchall()
+        rows = self.iter_rows_where(table, where_clause)
         table_structure = self.get_table_structure(table)
         columns_to_return = list(range(0, len(table_structure)))
 
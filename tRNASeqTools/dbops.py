@@ -3,12 +3,17 @@
 
 import os
 import time
+import functools
 
 import tRNASeqTools
 import tRNASeqTools.db as db
+import tRNASeqTools.utils as utils
 import tRNASeqTools.tables as t
 import tRNASeqTools.terminal as terminal
 import tRNASeqTools.filters as filters
+import tRNASeqTools.seqindex as seqindex
+
+from tRNASeqTools.errors import ConfigError
 
 
 __author__ = "Steven Cui"
@@ -25,6 +30,48 @@ progress = terminal.Progress()
 pp = terminal.pretty_print
 
 
+class SequenceFilters:
+    """The filters the query CLIs apply to the seqs of a profile, as a
+    parameterized where-clause (`where_clause`) and the values to bind to it
+    (`values`). Only seqs without a trailer that have an anticodon are selected.
+    `summary_where_clause` selects the same seqs from the anticodon summary
+    table, and takes the same values.
+
+    The SQL text only depends on which filters are set (and on the number of
+    anticodons), so SQLite sees the same statement for every sample and every
+    set of values, and reuses the plan it has compiled for it (sqlite3 keeps a
+    cache of compiled statements for each connection). Use
+    `get_sequence_filters` to get one, so the same instance is shared."""
+
+    def __init__(self, only_full_length=False, min_seq_length=None, max_seq_length=None, anticodons=None):
+        conditions = ["Anticodon IS NOT NULL"]
+        values = []
+
+        if only_full_length:
+            conditions.append("Full_length = 1")
+        if min_seq_length:
+            conditions.append("Seq_length >= ?")
+            values.append(min_seq_length)
+        if max_seq_length:
+            conditions.append("Seq_length <= ?")
+            values.append(max_seq_length)
+        if anticodons:
+            anticodons_list = anticodons.split(",")
+            conditions.append("Anticodon IN (%s)" % ','.join(['?'] * len(anticodons_list)))
+            values.extend(anticodons_list)
+
+        self.where_clause = " AND ".join(["Three_trailer IS NULL"] + conditions)
+        self.summary_where_clause = " AND ".join(["Has_trailer = 0"] + conditions)
+        self.values = tuple(values)
+
+
+@functools.lru_cache(maxsize=None)
+def get_sequence_filters(only_full_length=False, min_seq_length=None, max_seq_length=None, anticodons=None):
+    """Returns a SequenceFilters instance, building one only the first time a
+    given set of filters is asked for."""
+    return SequenceFilters(only_full_length, min_seq_length, max_seq_length, anticodons)
+
+
 class tRNADatabase:
     def __init__(self, db_path, run=run, progress=progress, quiet=True):
         self.db = None
@@ -61,44 +108,46 @@ class tRNADatabase:
 
         # creating empty default tables
         self.db.create_table(t.profile_table_name, t.profile_table_structure, t.profile_table_types)
+        self.db.create_table(t.rejected_table_name, t.rejected_table_structure, t.rejected_table_types)
+        self.db.create_table(t.anticodon_summary_table_name, t.anticodon_summary_table_structure, t.anticodon_summary_table_types)
 
         self.disconnect()
 
         self.run.info('Profile database', 'A new database, %s, has been created.' % (self.db_path), quiet=self.quiet)
 
 
+    def create_indexes(self):
+        """Creates the indexes of the profile database (which is best done once
+        the tables are populated)."""
+        for index_name, table_name, columns, where_clause in t.profile_db_indexes:
+            self.db.create_index(index_name, table_name, columns, where_clause)
+
+
     def disconnect(self):
         self.db.disconnect()
 
 
-    def get_sequences_dict(self, only_full_length, min_seq_length, max_seq_length, anticodons=None): 
-        """returns an anticodon profile from the database"""
+    def iter_sequences(self, only_full_length, min_seq_length, max_seq_length, anticodons=None, unique=False):
+        """Yields a (seq_id, seq, props, frequency) tuple for each seq that
+        matches the filters, where props is a list of (name, value) tuples.
 
-        where_clause = "Three_trailer IS NULL AND Anticodon IS NOT NULL"
-        if only_full_length:
-            where_clause += " AND Full_length = 'True'"
-        if min_seq_length:
-            where_clause += (" AND Seq_length >= " + str(min_seq_length))
-        if max_seq_length:
-            where_clause += (" AND Seq_length <= " + str(max_seq_length))
-        if anticodons:
-            spec_anticodons_list = anticodons.split(",")
-            or_string = " OR ".join(["Anticodon IN ('" + spec_anticodon + "')"
-                for spec_anticodon in spec_anticodons_list])
-            where_clause += " AND (" + or_string + ")"
+        Without `unique`, every read is yielded as it comes out of the database,
+        with a frequency of 1. With `unique`, SQLite dereplicates the seqs, and
+        each distinct seq is yielded once (the most frequent ones first) along
+        with the ID of the first read that has it, and its number of reads.
+        Either way, only a batch of rows is in memory at any given time."""
+        sequence_filters = get_sequence_filters(only_full_length, min_seq_length, max_seq_length, anticodons)
 
-        sequences_dict = {}
-        d = self.db.get_some_rows_from_table_as_dict(t.profile_table_name, where_clause)
-        for entry in d:
-            seq = d[entry]['Seq']
-            props = dict([(key, str(d[entry][key])) for key in ['Full_length', 'Anticodon', 'Acceptor']])
-
-            if seq in sequences_dict:
-                sequences_dict[seq]['ids'].add(entry)
-            else:
-                sequences_dict[seq] = {'props': props, 'ids': set([entry])}
+        if unique:
+            # the other columns come from the row MIN() picks, which is the
+            # first read with the seq
+            query = """SELECT ID, Seq, Full_length, Anticodon, Acceptor, COUNT(*), MIN(rowid) FROM %s WHERE %s
+                       GROUP BY Seq ORDER BY COUNT(*) DESC, Seq DESC""" % (t.profile_table_name, sequence_filters.where_clause)
+        else:
+            query = """SELECT ID, Seq, Full_length, Anticodon, Acceptor, 1, rowid FROM %s WHERE %s""" % (t.profile_table_name, sequence_filters.where_clause)
 
-        return sequences_dict
+        for seq_id, seq, full_length, anticodon, acceptor, frequency, rowid in self.db.iter_query(query, sequence_filters.values):
+            yield (seq_id, seq, [('Full_length', bool(full_length)), ('Anticodon', anticodon), ('Acceptor', acceptor)], frequency)
 
 
     def gen_anticodon_profile(self, only_full_length, min_seq_length, max_seq_length, anticodons): 
@@ -106,33 +155,71 @@ class tRNADatabase:
 
         anticodon_count_dict = {}
 
-        where_clause = "Three_trailer IS NULL AND Anticodon IS NOT NULL"
-        if only_full_length:
-            where_clause += " AND Full_length = 'True'"
-        if min_seq_length:
-            where_clause += (" AND Seq_length >= " + str(min_seq_length))
-        if max_seq_length:
-            where_clause += (" AND Seq_length <= " + str(max_seq_length))
-        if anticodons:
-            spec_anticodons_list = anticodons.split(",")
-            or_string = " OR ".join(["Anticodon IN ('" + spec_anticodon + "')"
-                for spec_anticodon in spec_anticodons_list])
-            where_clause += " AND (" + or_string + ")"
+        sequence_filters = get_sequence_filters(only_full_length, min_seq_length, max_seq_length, anticodons)
 
-        profile_dict_no_trailer = self.db.get_some_rows_from_table_as_dict(t.profile_table_name, where_clause)
+        # the counts come from the anticodon summary table, which has a few
+        # hundred rows no matter how many seqs are in the profile table. a seq
+        # with more than one candidate anticodon counts towards each of them
+        response = self.db._exec("""SELECT Anticodon, SUM(Count) FROM %s WHERE %s GROUP BY Anticodon""" % (t.anticodon_summary_table_name, sequence_filters.summary_where_clause),
+                                 sequence_filters.values)
 
-        for key in list(profile_dict_no_trailer.keys()):
-            anticodon_list = profile_dict_no_trailer[key]["Anticodon"].split(",")
-                
-            for anticodon in anticodon_list:
+        for anticodon_column, count in response:
+            for anticodon in anticodon_column.split(","):
                 if anticodon in anticodon_count_dict:
-                    anticodon_count_dict[anticodon] += 1
+                    anticodon_count_dict[anticodon] += count
                 else:
-                    anticodon_count_dict[anticodon] = 1
+                    anticodon_count_dict[anticodon] = count
 
         return anticodon_count_dict
 
 
+    def iter_subsequence_anticodons(self):
+        """Yields a (seq_id, anticodons) tuple for each seq without an anticodon
+        that is a subsequence of seqs with one, where anticodons is the list of
+        the anticodons of those seqs (i.e., the anticodons the seq would have had
+        if it was not a fragment). The profile table is left as is."""
+
+        assigned = self.db._exec("""SELECT DISTINCT Seq, Anticodon FROM %s WHERE Anticodon IS NOT NULL""" % t.profile_table_name).fetchall()
+        index = seqindex.SubsequenceIndex([seq for seq, anticodon in assigned])
+
+        # seq -> its anticodons, as many reads share the same seq
+        found = {}
+
+        unassigned = self.db.iter_query("""SELECT ID, Seq FROM %s WHERE Anticodon IS NULL""" % t.profile_table_name)
+        for seq_id, seq in unassigned:
+            if seq not in found:
+                found[seq] = []
+                for i in index.find(seq):
+                    for anticodon in assigned[i][1].split(","):
+                        if anticodon not in found[seq]:
+                            found[seq].append(anticodon)
+
+            if found[seq]:
+                yield (seq_id, list(found[seq]))
+
+
+    def get_rejected_reads(self, filter_names=None):
+        """Returns a list of (read_id, seq, filter, missed) tuples for the reads
+        that were rejected by any of `filter_names` (or by any filter), where
+        `missed` is the list of guidelines the read missed."""
+        return list(self.iter_rejected_reads(filter_names))
+
+
+    def iter_rejected_reads(self, filter_names=None):
+        """Same as `get_rejected_reads`, but yields the tuples one at a time."""
+
+        if not self.db._exec("""SELECT name FROM sqlite_master WHERE type='table' AND name=?""", (t.rejected_table_name, )).fetchall():
+            raise ConfigError("The profile database '%s' does not have a table for rejected reads. It was probably\
+                                generated before trna-profile knew how to store them." % self.db_path)
+
+        where_clause, values = None, ()
+        if filter_names:
+            where_clause, values = """Filter IN (%s)""" % ','.join(['?'] * len(filter_names)), tuple(filter_names)
+
+        for read_id, seq, filter_name, missed in self.db.iter_rows_where(t.rejected_table_name, where_clause, values, columns=t.rejected_table_structure):
+            yield (read_id, seq, filter_name, missed.split(',') if missed else [])
+
+
     def print_stats(self):
         pretty_names = [('total_seqs', 'Total num seqs', None),
                         ('total_passed', 'Total passed as tRNA seq', 'green'),
@@ -151,7 +238,9 @@ class tRNADatabase:
 ##                        ('div_at_neg_2', 'Acceptor divergence at pos -2', None),
 ##                        ('div_at_neg_3', 'Acceptor divergence at pos -3', None)]
 
-        for elem in filters.IsTRNA("").getFilters()[0]:
+        if 'Low_quality' in self.stats:
+            pretty_names.append(('Low_quality', 'Failed at quality filter', None))
+        for elem in filters.IsTRNA().getFilters()[0]:
             pretty_names.append((str(elem), "Failed at " + str(elem), None))
         for key, label, color in pretty_names:
             try:
@@ -163,21 +252,185 @@ class tRNADatabase:
                 self.run.info(label, 0)
 
 
+def migrate_profile_db_v1_to_v2(profile_db):
+    """Stores Full_length as 1/0 rather than 'True'/'False' (and the lengths as
+    integers), and adds the rejected reads table and the indexes. Takes a db.DB
+    instance."""
+    columns = ', '.join(t.profile_table_structure)
+
+    profile_db._exec("""ALTER TABLE %s RENAME TO %s_v1""" % (t.profile_table_name, t.profile_table_name))
+    profile_db.create_table(t.profile_table_name, t.profile_table_structure, t.profile_table_types)
+    profile_db._exec("""INSERT INTO %s (%s) SELECT ID, Seq, Three_trailer, T_loop, Acceptor,
+                                                    CASE WHEN Full_length = 'True' THEN 1 ELSE 0 END,
+                                                    CAST(Seq_length AS INTEGER), CAST(Trailer_length AS INTEGER),
+                                                    Anticodon FROM %s_v1""" % (t.profile_table_name, columns, t.profile_table_name))
+    profile_db._exec("""DROP TABLE %s_v1""" % t.profile_table_name)
+
+    profile_db.create_table(t.rejected_table_name, t.rejected_table_structure, t.rejected_table_types)
+    for index_name, table_name, index_columns, where_clause in t.profile_db_indexes:
+        profile_db.create_index(index_name, table_name, index_columns, where_clause)
+
+
+def migrate_profile_db_v2_to_v3(profile_db):
+    """Adds the anticodon summary table, and fills it in from the profile table.
+    Takes a db.DB instance."""
+    profile_db.create_table(t.anticodon_summary_table_name, t.anticodon_summary_table_structure, t.anticodon_summary_table_types)
+    build_anticodon_summary(profile_db)
+
+
+def build_anticodon_summary(profile_db):
+    """(Re)builds the anticodon summary table from the rows of the profile table.
+    Takes a db.DB instance."""
+    profile_db._exec("""DELETE FROM %s""" % t.anticodon_summary_table_name)
+    profile_db._exec("""INSERT INTO %s (%s) SELECT Anticodon, Full_length, Seq_length, Three_trailer IS NOT NULL, COUNT(*) FROM %s
+                        GROUP BY Anticodon, Full_length, Seq_length, Three_trailer IS NOT NULL""" % (t.anticodon_summary_table_name,
+                                                                                                      ', '.join(t.anticodon_summary_table_structure),
+                                                                                                      t.profile_table_name))
+
+
+# version -> the function that upgrades a profile database from that version
+# to the next one
+profile_db_migrations = {1: migrate_profile_db_v1_to_v2,
+                         2: migrate_profile_db_v2_to_v3}
+
+
+def gen_anticodon_profiles(profile_db_paths, only_full_length=False, min_seq_length=None, max_seq_length=None, anticodons=None, num_threads=1):
+    """Yields a (sample_name, anticodon_profile) tuple for each profile database
+    in `profile_db_paths`, in the same order, where anticodon_profile is what
+    `tRNADatabase.gen_anticodon_profile` returns for it.
+
+    Each database is opened once, and up to `num_threads` of them are profiled
+    at the same time. Threads are enough for this, since SQLite does all the
+    counting, and it does not hold the GIL while it does."""
+    profile = functools.partial(_gen_anticodon_profile, only_full_length=only_full_length, min_seq_length=min_seq_length,
+                                max_seq_length=max_seq_length, anticodons=anticodons)
+
+    if num_threads == 1:
+        for profile_db_path in profile_db_paths:
+            yield profile(profile_db_path)
+        return
+
+    # importing multiprocessing takes a while, and most runs profile a single
+    # database, so it is only imported when there are threads to start
+    import multiprocessing.pool
+    pool = multiprocessing.pool.ThreadPool(num_threads)
+    try:
+        for result in pool.imap(profile, profile_db_paths):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _gen_anticodon_profile(profile_db_path, only_full_length, min_seq_length, max_seq_length, anticodons):
+    profile_db = tRNADatabase(profile_db_path)
+    try:
+        return profile_db.meta['sample_name'], profile_db.gen_anticodon_profile(only_full_length, min_seq_length, max_seq_length, anticodons)
+    finally:
+        profile_db.disconnect()
+
+
 class TableFortRNASequences:
-    """A class to populate the profile databse with tRNA results"""
+    """A class to populate the profile databse with tRNA results. It keeps a
+    single connection open from the first insert until `close` is called.
+
+    Sequences added with `add_sequence` (and rejected reads added with
+    `add_rejected_sequence`) are kept in a buffer as insert-ready rows, and the
+    buffer is written to the database (as a single transaction) whenever it
+    holds `max_buffer_rows` rows, or an estimated `max_buffer_bytes` bytes,
+    whichever comes first."""
     
-    def __init__(self, db_path, run=run, progress=progress):
+    def __init__(self, db_path, max_buffer_rows=None, max_buffer_bytes=None, run=run, progress=progress):
         self.db_path = db_path
         self.run = run
 
+        self.max_buffer_rows = max_buffer_rows
+        self.max_buffer_bytes = max_buffer_bytes
 
-    def append_sequences(self, tRNA_profile_list):
-        """Insert a seq and its info into the profile table in a tRNA datbase."""
+        self.buffer = []
+        self.rejected_buffer = []
+        self.buffer_bytes = 0
+        self.peak_buffer_bytes = 0
+        self.num_flushes = 0
 
-        values = []
-        for sequence_id, sequence_object in tRNA_profile_list:
-            values.append(sequence_object.gen_sql_query_info_tuple(sequence_id))
+        self.profile_db = tRNADatabase(self.db_path)
+        self.profile_db.db.begin_bulk_load()
 
-        profile_db = tRNADatabase(self.db_path)
-        profile_db.db._exec_many("""INSERT INTO %s VALUES (?,?,?,?,?,?,?,?,?)""" % (t.profile_table_name), values)
-        profile_db.disconnect()
+        self.insert_query = """INSERT INTO %s VALUES (%s)""" % (t.profile_table_name, ','.join(['?'] * len(t.profile_table_structure)))
+        self.rejected_insert_query = """INSERT INTO %s VALUES (%s)""" % (t.rejected_table_name, ','.join(['?'] * len(t.rejected_table_structure)))
+        self.anticodon_summary_insert_query = """INSERT INTO %s VALUES (%s)""" % (t.anticodon_summary_table_name, ','.join(['?'] * len(t.anticodon_summary_table_structure)))
+
+
+    def add_sequence(self, sequence_id, sequence_object):
+        """Adds a seq to the buffer, and flushes the buffer if it is full."""
+
+        self.buffer_row(sequence_object.gen_sql_query_info_tuple(sequence_id))
+
+
+    def add_rejected_sequence(self, read_id, seq, filter_name, missed=()):
+        """Adds a rejected read to the buffer, and flushes the buffer if it is full."""
+
+        self.buffer_row((read_id, seq, filter_name, ','.join(missed) if missed else None), rejected=True)
+
+
+    def buffer_row(self, row, rejected=False):
+        # the tuple itself, and every object in it
+        row_bytes = utils.get_approximate_size_in_bytes(row, *row)
+
+        # the buffer is flushed before a row that would not fit, so it stays
+        # within `max_buffer_bytes` (unless a single row is larger than that)
+        if self.max_buffer_bytes and self.buffer_bytes + row_bytes > self.max_buffer_bytes:
+            self.flush()
+
+        if rejected:
+            self.rejected_buffer.append(row)
+        else:
+            self.buffer.append(row)
+        self.buffer_bytes += row_bytes
+
+        if self.buffer_bytes > self.peak_buffer_bytes:
+            self.peak_buffer_bytes = self.buffer_bytes
+
+        if self.max_buffer_rows and len(self.buffer) + len(self.rejected_buffer) >= self.max_buffer_rows:
+            self.flush()
+
+
+    def flush(self):
+        """Writes the buffer into the database."""
+
+        if not self.buffer and not self.rejected_buffer:
+            return
+
+        if self.buffer:
+            self.profile_db.db._exec_many(self.insert_query, self.buffer)
+        if self.rejected_buffer:
+            self.profile_db.db._exec_many(self.rejected_insert_query, self.rejected_buffer)
+        self.profile_db.db.commit()
+
+        self.buffer = []
+        self.rejected_buffer = []
+        self.buffer_bytes = 0
+        self.num_flushes += 1
+
+
+    def store_anticodon_summary(self, anticodon_summary):
+        """Inserts the anticodon summary, a dict of (anticodon, full_length,
+        seq_length, has_trailer) -> number of seqs."""
+        self.profile_db.db._exec_many(self.anticodon_summary_insert_query,
+                                      [key + (count, ) for key, count in anticodon_summary.items()])
+        self.profile_db.db.commit()
+
+
+    def store_stats(self, stats_dict):
+        """Inserts all stats at once."""
+        self.profile_db.db.set_stat_values(stats_dict)
+        self.profile_db.db.commit()
+
+
+    def close(self):
+        """Flushes the buffer, creates the indexes, commits everything,
+        restores the default database settings and disconnects."""
+        self.flush()
+        self.profile_db.create_indexes()
+        self.profile_db.db.end_bulk_load()
+        self.profile_db.disconnect()
@@ -6,6 +6,7 @@ import csv
 
 import tRNASeqTools
 import tRNASeqTools.filters as filters
+import tRNASeqTools.seqindex as seqindex
 
 __author__ = "Steven Cui"
 __copyright__ = "Copyright 2016, The University of Chicago"
@@ -15,6 +16,11 @@ __version__ = tRNASeqTools.__version__
 __maintainer__ = "Steven Cui"
 __email__ = "stevencui729@gmail.com"
 
+
+# the anticodon arm is a 5 nt stem on each side of a 7 nt loop
+ANTICODON_ARM_LENGTH = 17
+ANTICODON_STEM_LENGTH = 5
+
 class ExtractorStats:
     """This class handles keeping track of extraction statistics."""
     
@@ -31,6 +37,18 @@ class ExtractorStats:
         for x in guidelines[1]:
             self.type_II_match_dict[x] = 0
 
+    def merge(self, other):
+        """Adds the statistics in another ExtractorStats instance to this one."""
+        self.total_seqs += other.total_seqs
+        self.type_I_seqs += other.type_I_seqs
+        self.type_II_seqs += other.type_II_seqs
+        self.subseq_match += other.subseq_match
+        for x in other.type_I_match_dict:
+            self.type_I_match_dict[x] += other.type_I_match_dict[x]
+        for x in other.type_II_match_dict:
+            self.type_II_match_dict[x] += other.type_II_match_dict[x]
+
+
     def format_line(self, label, value, level, padding = 55):
         """Handles indenting/formatting lines for statistics."""
         levels_dict = {1:"%s%s\t%s\n" % 
@@ -70,11 +88,85 @@ class Extractor:
     def __init__(self):
         """Initializes variables for the extractor"""
         self.extractor_stats_file = ""
-        self.loop_guidelines = filters.IsTRNA("").getAnticodonGuidelines()
-        self.extractor_stats = ExtractorStats([self.loop_guidelines[2], self.loop_guidelines[3]])
+        self.loop_guidelines = filters.IsTRNA().getAnticodonGuidelines()
+        self.reset_stats()
 
         self.allowed_pairings = {"G":("C", "T"), "T":("A", "G"), "C":("G"), "A":("T"), "N": ()}
 
+        self.compile_guidelines()
+
+
+    def reset_stats(self):
+        """Starts a fresh set of extraction statistics"""
+        self.extractor_stats = ExtractorStats([self.loop_guidelines[2], self.loop_guidelines[3]])
+
+
+    def compile_guidelines(self):
+        """Turns the pairing rules and the anticodon loop guidelines into lookup
+        tables indexed by byte values, which is what `find_anticodons` uses
+        instead of `pair_check` and `get_anticodon`."""
+
+        # pairs[(a << 8) | b] is 1 if base a pairs with base b (anything that is
+        # not in allowed_pairings pairs with nothing)
+        self.pairs = bytearray(256 * 256)
+        for a in self.allowed_pairings:
+            for b in self.allowed_pairings[a]:
+                self.pairs[(ord(a) << 8) | ord(b)] = 1
+
+        # bases that are allowed right before (34) and after (37) the anticodon
+        self.allowed_at_34 = bytearray(256)
+        self.allowed_at_37 = bytearray(256)
+        for allowed, bases in [(self.allowed_at_34, self.loop_guidelines[1][0]), (self.allowed_at_37, self.loop_guidelines[1][1])]:
+            for base in bases:
+                if len(base) == 1:
+                    allowed[ord(base)] = 1
+
+        # the distance between the start of the arm and the 3' end for each
+        # candidate type I and type II offset
+        anticodon_arm_start = self.loop_guidelines[4] + ANTICODON_ARM_LENGTH
+        self.type_I_arms = [(x, anticodon_arm_start + x) for x in self.loop_guidelines[2]]
+        self.type_II_arms = [(x, anticodon_arm_start + x) for x in self.loop_guidelines[3]]
+
+
+    def find_anticodons(self, seq, arms):
+        """Returns an (offset, anticodon) tuple for each of the candidate `arms` (a
+        list of (offset, distance of the arm from the 3' end) tuples, i.e.
+        `self.type_I_arms`) of the seq that has a valid anticodon. It gives the
+        same answers as running `pair_check` and `get_anticodon` on each arm."""
+        # a character that is not ASCII becomes a '?', which pairs with nothing
+        encoded = seq.encode('ascii', 'replace')
+        length = len(encoded)
+        pairs, allowed_at_34, allowed_at_37 = self.pairs, self.allowed_at_34, self.allowed_at_37
+        min_pairing = ANTICODON_STEM_LENGTH - self.loop_guidelines[0]
+
+        found = []
+        for x, arm_start in arms:
+            s = length - arm_start
+
+            if s < 0:
+                # the arm is cut short by the 5' end of the seq
+                a_arm = seq[-arm_start:-(arm_start - ANTICODON_ARM_LENGTH)]
+                if self.pair_check(a_arm):
+                    anticodon = self.get_anticodon(a_arm)
+                    if anticodon:
+                        found.append((x, anticodon))
+                continue
+
+            # the loop is cheaper to check than the stem, and rules out most arms
+            if not (allowed_at_34[encoded[s + 6]] and allowed_at_37[encoded[s + 10]]):
+                continue
+
+            pairing = pairs[(encoded[s] << 8) | encoded[s + 16]] + \
+                      pairs[(encoded[s + 1] << 8) | encoded[s + 15]] + \
+                      pairs[(encoded[s + 2] << 8) | encoded[s + 14]] + \
+                      pairs[(encoded[s + 3] << 8) | encoded[s + 13]] + \
+                      pairs[(encoded[s + 4] << 8) | encoded[s + 12]]
+
+            if pairing >= min_pairing:
+                found.append((x, seq[s + 7:s + 10]))
+
+        return found
+
 
     def pair_check(self, a_arm):
         """Checks a given anticodon arm for valid pairing"""
@@ -82,7 +174,7 @@ class Extractor:
         total_mismatch = 0
         
         for x in range(pair_seg_length):
-            if a_arm[-(x + 1)] not in self.allowed_pairings[a_arm[x]]:
+            if a_arm[-(x + 1)] not in self.allowed_pairings.get(a_arm[x], ()):
                 total_mismatch += 1
         return total_mismatch < self.loop_guidelines[0] + 1
 
@@ -102,29 +194,21 @@ class Extractor:
         """
         self.extractor_stats.total_seqs += 1
         length = len(seq)
-        anticodon_arm_start = self.loop_guidelines[4] + 17
-        anticodon_arm_end = self.loop_guidelines[4]
         anticodon_list = []
 
         # handles type I full-length seqs
         if fullLength and length < 78 or not fullLength and length > 50:
-            for x in self.loop_guidelines[2]:
-                if self.pair_check(seq[-(anticodon_arm_start + x):-(anticodon_arm_end + x)]):
-                    anticodon = self.get_anticodon(seq[-(anticodon_arm_start + x):-(anticodon_arm_end + x)])
-                    if len(anticodon) > 0:
-                        self.extractor_stats.type_I_match_dict[x] += 1
-                        self.extractor_stats.type_I_seqs += 1
-                        anticodon_list.append(anticodon)
+            for x, anticodon in self.find_anticodons(seq, self.type_I_arms):
+                self.extractor_stats.type_I_match_dict[x] += 1
+                self.extractor_stats.type_I_seqs += 1
+                anticodon_list.append(anticodon)
 
         # handles type II full-length seqs
         if fullLength and length > 81 or not fullLength and length > 67:
-            for x in self.loop_guidelines[3]:
-                if self.pair_check(seq[-(anticodon_arm_start + x):-(x + anticodon_arm_end)]):
-                    anticodon = self.get_anticodon(seq[-(anticodon_arm_start + x): -(anticodon_arm_end + x)])
-                    if len(anticodon) > 0:
-                        self.extractor_stats.type_II_match_dict[x] += 1
-                        self.extractor_stats.type_II_seqs += 1
-                        anticodon_list.append(anticodon)
+            for x, anticodon in self.find_anticodons(seq, self.type_II_arms):
+                self.extractor_stats.type_II_match_dict[x] += 1
+                self.extractor_stats.type_II_seqs += 1
+                anticodon_list.append(anticodon)
 
         return anticodon_list
 
@@ -146,12 +230,16 @@ class Extractor:
                 else:
                     unassigned_rows.append(row)
 
-        for row in unassigned_rows:
-            seq = row["Seq"].strip("-")
-            for key in list(match_dict.keys()):
-                if seq in key:
-                    self.extractor_stats.subseq_match += 1
-                    row["Anticodon"] = match_dict[key]
+        # every assigned seq an unassigned seq is a subsequence of counts as a
+        # match, and the last one of them gives it its anticodon
+        assigned_seqs = list(match_dict.keys())
+        index = seqindex.SubsequenceIndex(assigned_seqs)
+        matches = index.find_many([row["Seq"].strip("-") for row in unassigned_rows])
+
+        for row, indexes in zip(unassigned_rows, matches):
+            for i in indexes:
+                self.extractor_stats.subseq_match += 1
+                row["Anticodon"] = match_dict[assigned_seqs[i]]
                     
         with open(file_name, "w") as writefile:
             writefile_writer = csv.DictWriter(writefile, fieldnames=fieldnames,
@@ -3,10 +3,222 @@
 # v.140713
 """A very lightweight FASTA I/O library"""
 
+import os
 import sys
 import gzip
-import numpy
+import mmap
+import array
+import sqlite3
 import hashlib
+import tempfile
+
+
+# FASTA files are parsed in blocks of this many characters
+BLOCK_SIZE = 1024 * 1024
+
+# the offset index of a FASTA file goes next to it, with this suffix
+FASTA_INDEX_SUFFIX = '.fidx'
+
+# files are scanned in blocks of this many bytes when records are counted
+COUNT_BLOCK_SIZE = 16 * 1024 * 1024
+
+# (file path, record marker) -> (file size, modification time, num records)
+_record_counts = {}
+
+
+def fasta_records(file_pointer, block_size=BLOCK_SIZE, head='', separator=''):
+    """Yields (id, seq) tuples from a FASTA formatted file object.
+
+    The file is read in large blocks, and never seeked, so this works the same
+    way on plain, gzip and stdin streams. `head` is anything that was already
+    read from the stream before, and `separator` is put between the
+    whitespace-separated pieces of each record (i.e., ' ' for quality scores).
+    """
+    def parse(record):
+        header, _, body = record.partition('\n')
+        return header.strip(), separator.join(body.split())
+
+    # the leading newline makes the first record look like every other one
+    remainder = '\n' + head
+    first_block = True
+
+    while True:
+        block = file_pointer.read(block_size)
+        if not block:
+            break
+
+        records = (remainder + block).split('\n>')
+        remainder = records.pop()
+
+        if first_block and records:
+            records = records[1:]
+            first_block = False
+
+        for record in records:
+            yield parse(record)
+
+    if first_block:
+        remainder = remainder.lstrip('\n')[1:]
+
+    if remainder.strip():
+        yield parse(remainder)
+
+
+def fastq_records(file_pointer, block_size=BLOCK_SIZE, head=''):
+    """Yields (id, seq, quals) tuples from a FASTQ formatted file object, with
+    the same block-reading approach `fasta_records` uses. Every record is
+    expected to occupy exactly four lines.
+    """
+    remainder = head
+    lines = []
+
+    while True:
+        block = file_pointer.read(block_size)
+        if block:
+            block_lines = (remainder + block).split('\n')
+            remainder = block_lines.pop()
+            lines.extend(block_lines)
+        else:
+            if remainder:
+                lines.append(remainder)
+                remainder = ''
+            # ignore trailing empty lines
+            while lines and not lines[-1].strip():
+                lines.pop()
+
+        num_complete = len(lines) - (len(lines) % 4)
+        for i in range(0, num_complete, 4):
+            header, seq, separator, quals = lines[i:i + 4]
+            if not header.startswith('@') or not separator.startswith('+'):
+                raise FastaLibError("Record '%s' does not look like a FASTQ record." % header.strip())
+            yield header[1:].strip(), seq.strip(), quals.strip()
+
+        lines = lines[num_complete:]
+
+        if not block:
+            break
+
+    if lines:
+        raise FastaLibError("The FASTQ input seems to be truncated (the last record has only %d lines)." % len(lines))
+
+
+def count_in_file(file_path, pattern, block_size=COUNT_BLOCK_SIZE, return_tail=False):
+    """Returns the number of (non-overlapping) occurrences of the bytes
+    `pattern` in a plain or gzip-compressed file. Plain files are memory mapped,
+    and only a block of `block_size` bytes of either is in memory at a time.
+
+    With `return_tail`, returns a (count, tail) tuple instead, where tail is the
+    last len(pattern) bytes of the (decompressed) contents of the file, so
+    callers can tell whether it ends with the pattern, or is empty."""
+    count = 0
+    overlap = len(pattern) - 1
+    tail = b''
+
+    if file_path.endswith('.gz'):
+        with gzip.open(file_path, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+
+                # the end of the previous block goes in front, so occurrences
+                # that span two blocks are not missed (and, as the tail is
+                # shorter than the pattern, none is counted twice)
+                block = tail[len(tail) - overlap:] + block if overlap else block
+                count += block.count(pattern)
+                tail = block[-len(pattern):]
+
+    elif os.path.getsize(file_path):
+        with open(file_path, 'rb') as f:
+            contents = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                # each slice reaches into the next block just far enough to find
+                # the occurrences that start in this one
+                for start in range(0, len(contents), block_size):
+                    count += contents[start:start + block_size + overlap].count(pattern)
+                tail = contents[-len(pattern):]
+            finally:
+                contents.close()
+
+    return (count, tail) if return_tail else count
+
+
+def count_records(file_path, marker='>'):
+    """Returns the number of records in a (plain or gzip-compressed) FASTA file,
+    i.e., the number of lines that start with `marker`. The count is cached,
+    and used again as long as the size and the modification time of the file
+    stay the same."""
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), marker)
+
+    if key in _record_counts and _record_counts[key][:2] == (stat.st_size, stat.st_mtime_ns):
+        return _record_counts[key][2]
+
+    marker = marker.encode('ascii')
+    num_records = count_in_file(file_path, b'\n' + marker)
+
+    # the first record is not preceded by a new line
+    if file_path.endswith('.gz'):
+        with gzip.open(file_path, 'rb') as f:
+            head = f.read(len(marker))
+    else:
+        with open(file_path, 'rb') as f:
+            head = f.read(len(marker))
+    if head == marker:
+        num_records += 1
+
+    _record_counts[key] = (stat.st_size, stat.st_mtime_ns, num_records)
+
+    return num_records
+
+
+def get_sequence_file_format(file_path):
+    """Returns 'fasta' or 'fastq' depending on the first character of a (plain,
+    gzip-compressed or '-' for stdin) sequence file, or None if it is neither."""
+    if file_path == '-':
+        head = sys.stdin.buffer.peek(1)[:1]
+    elif file_path.endswith('.gz'):
+        with gzip.open(file_path) as f:
+            head = f.read(1)
+    else:
+        with open(file_path, 'rb') as f:
+            head = f.read(1)
+
+    return {b'>': 'fasta', b'@': 'fastq'}.get(head)
+
+
+class QualityFilter:
+    """Trims low quality bases from the 3' end of reads, and drops reads that
+    become empty or have a low mean quality after trimming."""
+
+    def __init__(self, trim_quality=None, min_mean_quality=None, phred_offset=33):
+        self.trim_quality = trim_quality
+        self.min_mean_quality = min_mean_quality
+        self.phred_offset = phred_offset
+
+        # maps every quality character to '1' if it is good enough to be kept at
+        # the 3' end, and to '0' if it should be trimmed
+        self.trimming_table = None
+        if self.trim_quality is not None:
+            threshold = self.phred_offset + self.trim_quality
+            self.trimming_table = str.maketrans(''.join([chr(c) for c in range(128)]),
+                                                ''.join(['1' if c >= threshold else '0' for c in range(128)]))
+
+    def filter(self, seq, quals):
+        """Returns the trimmed seq, or None if it does not pass."""
+        if self.trimming_table:
+            end = quals.translate(self.trimming_table).rfind('1') + 1
+            seq, quals = seq[:end], quals[:end]
+
+        if not seq:
+            return None
+
+        if self.min_mean_quality is not None:
+            mean_quality = sum(quals.encode('ascii')) / len(quals) - self.phred_offset
+            if mean_quality < self.min_mean_quality:
+                return None
+
+        return seq
 
 
 class FastaOutput:
@@ -50,12 +262,12 @@ class ReadFasta:
 
         self.fasta = SequenceSource(f_name)
 
-        while next(self.fasta):
-            if self.fasta.pos % 1000 == 0 or self.fasta.pos == 1:
-                sys.stderr.write('\r[fastalib] Reading FASTA into memory: %s' % (self.fasta.pos))
+        for pos, id, seq in self.fasta.iter_records():
+            if pos % 1000 == 0 or pos == 1:
+                sys.stderr.write('\r[fastalib] Reading FASTA into memory: %s' % (pos))
                 sys.stderr.flush()
-            self.ids.append(self.fasta.id)
-            self.sequences.append(self.fasta.seq)
+            self.ids.append(id)
+            self.sequences.append(seq)
 
         sys.stderr.write('\n')
 
@@ -63,8 +275,243 @@ class ReadFasta:
         self.fasta.close()
 
 
+class FastaIndex:
+    """Random access to the records of a (plain) FASTA file by their IDs.
+
+    The index is a tab-separated text file next to the FASTA file (with the
+    FASTA_INDEX_SUFFIX), like a samtools .fai file, with a line for each record:
+    its ID (the entire header line), the length of its seq, and the offset and
+    the number of bytes of its seq in the file. It is built with a single pass
+    over the file, and built again if the FASTA file is newer than the index.
+    Seqs are read from a memory map of the FASTA file, so a lookup does not
+    depend on the size of the file. If more than one record has the same ID,
+    the first one is indexed."""
+
+    def __init__(self, fasta_file_path, index_file_path=None):
+        if fasta_file_path == '-' or fasta_file_path.endswith('.gz'):
+            raise FastaLibError("Only plain FASTA files can be indexed, '%s' is not one." % fasta_file_path)
+
+        self.fasta_file_path = fasta_file_path
+        self.index_file_path = index_file_path or fasta_file_path + FASTA_INDEX_SUFFIX
+
+        if not FastaIndex.is_fresh(self.fasta_file_path, self.index_file_path):
+            FastaIndex.build(self.fasta_file_path, self.index_file_path)
+
+        # id -> (offset, number of bytes)
+        self.offsets = {}
+        with open(self.index_file_path) as index_file:
+            for line in index_file:
+                read_id, seq_length, offset, num_bytes = line.rstrip('\n').rsplit('\t', 3)
+                self.offsets[read_id] = (int(offset), int(num_bytes))
+
+        self.file_pointer = open(self.fasta_file_path, 'rb')
+        self.map = mmap.mmap(self.file_pointer.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.fasta_file_path) else b''
+
+
+    @staticmethod
+    def is_fresh(fasta_file_path, index_file_path):
+        return os.path.exists(index_file_path) and os.path.getmtime(index_file_path) >= os.path.getmtime(fasta_file_path)
+
+
+    @staticmethod
+    def build(fasta_file_path, index_file_path):
+        """Writes the index of `fasta_file_path` into `index_file_path`."""
+        with open(fasta_file_path, 'rb') as f:
+            if not os.path.getsize(fasta_file_path):
+                raise FastaLibError("File '%s' does not seem to be a FASTA file." % fasta_file_path)
+
+            contents = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if contents[:1] != b'>':
+                    raise FastaLibError("File '%s' does not seem to be a FASTA file." % fasta_file_path)
+
+                seen = set()
+                lines = []
+                start, size = 1, len(contents)
+                while start < size:
+                    end = contents.find(b'\n>', start)
+                    end = size if end == -1 else end
+
+                    header_end = contents.find(b'\n', start, end)
+                    seq_start = end if header_end == -1 else header_end + 1
+
+                    read_id = contents[start:seq_start].decode('utf-8').strip()
+                    if read_id not in seen:
+                        seen.add(read_id)
+                        seq_length = len(b''.join(contents[seq_start:end].split()))
+                        lines.append('%s\t%d\t%d\t%d\n' % (read_id, seq_length, seq_start, end - seq_start))
+
+                    start = end + 2
+            finally:
+                contents.close()
+
+        # write the index under a temporary name first, so a half-written index
+        # never looks like a fresh one
+        with open(index_file_path + '.tmp', 'w') as index_file:
+            index_file.write(''.join(lines))
+        os.replace(index_file_path + '.tmp', index_file_path)
+
+
+    def __contains__(self, read_id):
+        return read_id in self.offsets
+
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+    def get(self, read_id):
+        """Returns the seq of `read_id`, or None if there is no such read."""
+        if read_id not in self.offsets:
+            return None
+
+        offset, num_bytes = self.offsets[read_id]
+        return b''.join(self.map[offset:offset + num_bytes].split()).decode('utf-8')
+
+
+    def get_many(self, read_ids):
+        """Returns a read id -> seq dict for the `read_ids` that are in the file.
+        The seqs are read in the order they are in the file."""
+        found = sorted([(self.offsets[read_id], read_id) for read_id in set(read_ids) if read_id in self.offsets])
+        return dict([(read_id, self.get(read_id)) for offsets, read_id in found])
+
+
+    def close(self):
+        if self.map:
+            self.map.close()
+        self.file_pointer.close()
+
+
+class UniqueSequences:
+    """Dereplicates reads with a small memory footprint, for
+    `SequenceSource(unique=True, unique_backend='compact')`.
+
+    Each distinct (upper case) seq is keyed by the first 16 bytes of its SHA1
+    digest, and only the seq and the ID of its first read, and the positions of
+    all of its reads in the input (as an `array('I')`) are kept. If
+    `max_bytes_in_memory` is set, the entries are moved into a temporary SQLite
+    database in `spill_dir` whenever their estimated size in memory would go
+    over it.
+    Either way, `iter_by_frequency` yields them in the order the 'dict' backend
+    does (by the number of reads, then by the digest, both descending)."""
+
+    def __init__(self, max_bytes_in_memory=None, spill_dir=None):
+        self.max_bytes_in_memory = max_bytes_in_memory
+        self.spill_dir = spill_dir
+
+        # digest -> [first read id, seq, read positions]
+        self.entries = {}
+        self.entries_bytes = 0
+
+        self.num_spills = 0
+
+        self.spill_path = None
+        self.spill_db = None
+        self.num_spilled = None
+
+
+    def add(self, read_id, seq, position):
+        digest = hashlib.sha1(seq.upper().encode('utf-8')).digest()[:16]
+
+        entry = self.entries.get(digest)
+        entry_bytes = entry[2].itemsize if entry else self.get_new_entry_bytes(digest, read_id, seq)
+
+        if self.max_bytes_in_memory and self.entries and self.entries_bytes + entry_bytes > self.max_bytes_in_memory:
+            self.spill()
+            entry = None
+            entry_bytes = self.get_new_entry_bytes(digest, read_id, seq)
+
+        if entry:
+            entry[2].append(position)
+        else:
+            self.entries[digest] = [read_id, seq, array.array('I', [position])]
+
+        self.entries_bytes += entry_bytes
+
+
+    def get_new_entry_bytes(self, digest, read_id, seq):
+        """Returns the estimated size of a new entry: the key, the list, and
+        everything in it. The dict slot is not counted, and neither are the
+        spare items an array allocates as it grows."""
+        return sys.getsizeof(digest) + sys.getsizeof([None] * 3) + sys.getsizeof(read_id) + \
+               sys.getsizeof(seq) + sys.getsizeof(array.array('I', [0]))
+
+
+    def spill(self):
+        """Moves the entries in memory into the spill database."""
+        if not self.spill_db:
+            fd, self.spill_path = tempfile.mkstemp(suffix='.db', dir=self.spill_dir)
+            os.close(fd)
+            self.spill_db = sqlite3.connect(self.spill_path)
+            self.spill_db.execute("PRAGMA journal_mode = OFF")
+            self.spill_db.execute("PRAGMA synchronous = OFF")
+            self.spill_db.execute("CREATE TABLE uniques (digest BLOB PRIMARY KEY, id TEXT, seq TEXT, count INTEGER)")
+            self.spill_db.execute("CREATE TABLE positions (digest BLOB, positions BLOB)")
+
+        # an entry that is already in there keeps its first read, and its
+        # positions come in one more block
+        self.spill_db.executemany("""INSERT INTO uniques VALUES (?,?,?,?)
+                                     ON CONFLICT(digest) DO UPDATE SET count = count + excluded.count""",
+                                  [(digest, read_id, seq, len(positions)) for digest, (read_id, seq, positions) in self.entries.items()])
+        self.spill_db.executemany("INSERT INTO positions VALUES (?,?)",
+                                  [(digest, positions.tobytes()) for digest, (read_id, seq, positions) in self.entries.items()])
+        self.spill_db.commit()
+
+        self.entries = {}
+        self.entries_bytes = 0
+        self.num_spills += 1
+
+
+    def finalize(self):
+        """Called once all reads are added."""
+        if self.spill_db:
+            if self.entries:
+                self.spill()
+            self.spill_db.execute("CREATE INDEX positions_digest_index ON positions (digest)")
+            self.num_spilled = self.spill_db.execute("SELECT COUNT(*) FROM uniques").fetchone()[0]
+
+
+    def __len__(self):
+        return self.num_spilled if self.spill_db else len(self.entries)
+
+
+    def iter_by_frequency(self):
+        """Yields a (first read id, seq, read positions) tuple for each distinct seq."""
+        if self.spill_db:
+            # a cursor of its own, so the positions can be queried along the way
+            cursor = self.spill_db.cursor()
+            cursor.execute("SELECT digest, id, seq FROM uniques ORDER BY count DESC, digest DESC")
+            for digest, read_id, seq in cursor:
+                positions = array.array('I')
+                for block, in self.spill_db.execute("SELECT positions FROM positions WHERE digest = ? ORDER BY rowid", (digest, )):
+                    positions.frombytes(block)
+                yield read_id, seq, positions
+        else:
+            for digest in sorted(self.entries, key=lambda digest: (len(self.entries[digest][2]), digest), reverse=True):
+                yield tuple(self.entries[digest])
+
+
+    def close(self):
+        if self.spill_db:
+            self.spill_db.close()
+            os.remove(self.spill_path)
+            self.spill_db = None
+
+
 class SequenceSource():
-    def __init__(self, fasta_file_path, lazy_init=True, unique=False, allow_mixed_case=False):
+    """Reads a FASTA file one record at a time.
+
+    With `unique`, the reads are dereplicated first, and each distinct seq is
+    read once, the most frequent ones first, with `ids` holding the IDs of all
+    of its reads. The default 'dict' backend keeps everything about every read
+    in memory. The 'compact' backend (see `UniqueSequences`) is meant for large
+    inputs: `ids` holds the positions of the reads in the input instead of their
+    IDs, and `max_unique_bytes_in_memory` caps the (estimated) number of bytes the
+    distinct seqs take in memory before it starts using a temporary database in
+    `spill_dir`."""
+
+    def __init__(self, fasta_file_path, lazy_init=True, unique=False, allow_mixed_case=False,
+                 unique_backend='dict', max_unique_bytes_in_memory=None, spill_dir=None):
         self.fasta_file_path = fasta_file_path
         self.name = None
         self.compressed = True if self.fasta_file_path.endswith('.gz') else False
@@ -81,26 +528,44 @@ class SequenceSource():
         self.unique_hash_list = []
         self.unique_next_hash = 0
 
-        if self.compressed:
-            self.file_pointer = gzip.open(self.fasta_file_path)
+        if unique_backend not in ['dict', 'compact']:
+            raise FastaLibError("Unknown unique backend '%s' (it can be 'dict' or 'compact')." % unique_backend)
+        self.unique_sequences = UniqueSequences(max_unique_bytes_in_memory, spill_dir) if unique_backend == 'compact' else None
+        self.unique_entries = None
+
+        self.fasta_index = None
+
+        if self.fasta_file_path == '-':
+            self.file_pointer = sys.stdin
+        elif self.compressed:
+            self.file_pointer = gzip.open(self.fasta_file_path, 'rt')
         else:
             self.file_pointer = open(self.fasta_file_path)
 
-        if not self.file_pointer.read(1) == '>':
+        head = self.file_pointer.read(1)
+        if not head == '>':
             raise FastaLibError("File '%s' does not seem to be a FASTA file." % self.fasta_file_path)
 
-        self.file_pointer.seek(0)
+        self.records = fasta_records(self.file_pointer, head=head)
 
-        if self.lazy_init:
+        if self.lazy_init or self.fasta_file_path == '-':
             self.total_seq = None
         else:
-            self.total_seq = len([l for l in self.file_pointer.readlines() if l.startswith('>')])
-            self.reset()
+            self.total_seq = count_records(self.fasta_file_path)
 
         if self.unique:
             self.init_unique_hash()
 
     def init_unique_hash(self):
+        if self.unique_sequences is not None:
+            for pos, id, seq in self.iter_records():
+                self.unique_sequences.add(id, seq, pos)
+            self.unique_sequences.finalize()
+
+            self.total_unique = len(self.unique_sequences)
+            self.reset()
+            return
+
         while self.next_regular():
             hash = hashlib.sha1(self.seq.upper().encode('utf-8')).hexdigest()
             if hash in self.unique_hash_dict:
@@ -126,7 +591,17 @@ class SequenceSource():
             return self.next_regular()
 
     def next_unique(self):
-        if self.unique:
+        if self.unique and self.unique_sequences is not None:
+            if self.total_unique > 0 and self.pos < self.total_unique:
+                self.id, seq, self.ids = next(self.unique_entries)
+
+                self.pos += 1
+                self.seq = seq if self.allow_mixed_case else seq.upper()
+
+                return True
+            else:
+                return False
+        elif self.unique:
             if self.total_unique > 0 and self.pos < self.total_unique:
                 hash_entry = self.unique_hash_dict[self.unique_hash_list[self.pos]]
 
@@ -143,39 +618,69 @@ class SequenceSource():
 
     def next_regular(self):
         self.seq = None
-        self.id = self.file_pointer.readline()[1:].strip()
-        sequence = ''
 
-        while True:
-            line = self.file_pointer.readline()
-            if not line:
-                if len(sequence):
-                    self.seq = sequence if self.allow_mixed_case else sequence.upper()
-                    self.pos += 1
-                    return True
-                else:
-                    return False
-            if line.startswith('>'):
-                self.file_pointer.seek(self.file_pointer.tell() - len(line))
-                break
-            sequence += line.strip()
+        try:
+            self.id, sequence = next(self.records)
+        except StopIteration:
+            return False
 
         self.seq = sequence if self.allow_mixed_case else sequence.upper()
         self.pos += 1
         return True
 
 
+    def iter_records(self):
+        """Yields (pos, id, seq) tuples for the remaining records. This is much
+        cheaper than calling next() for every record."""
+        upper = not self.allow_mixed_case
+
+        for self.id, seq in self.records:
+            self.pos += 1
+            self.seq = seq.upper() if upper else seq
+            yield self.pos, self.id, self.seq
+
+
     def get_seq_by_read_id(self, read_id):
+        """Returns the seq of `read_id`, or False if there is no such read. It
+        uses the offset index of the file if there is an up-to-date one (see
+        `FastaIndex`), and goes through the entire file otherwise."""
+        if self.fasta_index is None and not self.compressed and self.fasta_file_path != '-' and \
+           FastaIndex.is_fresh(self.fasta_file_path, self.fasta_file_path + FASTA_INDEX_SUFFIX):
+            self.fasta_index = FastaIndex(self.fasta_file_path)
+
+        if self.fasta_index is not None:
+            seq = self.fasta_index.get(read_id)
+            if seq is None:
+                return False
+            return seq if self.allow_mixed_case else seq.upper()
+
         self.reset()
-        while next(self):
-            if self.id == read_id:
-                return self.seq
+        for pos, id, seq in self.iter_records():
+            if id == read_id:
+                return seq
 
         return False
 
 
+    def get_seqs_by_read_ids(self, read_ids):
+        """Returns a read id -> seq dict for the `read_ids` that are in the file.
+        The offset index of the file is built first if there isn't one."""
+        if self.fasta_index is None:
+            self.fasta_index = FastaIndex(self.fasta_file_path)
+
+        seqs = self.fasta_index.get_many(read_ids)
+        if not self.allow_mixed_case:
+            seqs = dict([(read_id, seq.upper()) for read_id, seq in seqs.items()])
+
+        return seqs
+
+
     def close(self):
         self.file_pointer.close()
+        if self.unique_sequences is not None:
+            self.unique_sequences.close()
+        if self.fasta_index is not None:
+            self.fasta_index.close()
 
     def reset(self):
         self.pos = 0
@@ -183,8 +688,12 @@ class SequenceSource():
         self.seq = None
         self.ids = []
         self.file_pointer.seek(0)
+        self.records = fasta_records(self.file_pointer)
+        if self.unique_sequences is not None:
+            self.unique_entries = self.unique_sequences.iter_by_frequency()
 
     def visualize_sequence_length_distribution(self, title, dest=None, max_seq_len=None, xtickstep=None, ytickstep=None):
+        import numpy
         import matplotlib.pyplot as plt
         import matplotlib.gridspec as gridspec
 
@@ -268,6 +777,100 @@ class SequenceSource():
         return
 
 
+class FastqSource:
+    """Reads a FASTQ file one record at a time. Quality scores are decoded with
+    `phred_offset`, which defaults to the one of the quality filter (or 33)."""
+
+    def __init__(self, fastq_file_path, quality_filter=None, allow_mixed_case=False, phred_offset=None):
+        self.fastq_file_path = fastq_file_path
+        self.compressed = True if self.fastq_file_path.endswith('.gz') else False
+        self.quality_filter = quality_filter
+        self.allow_mixed_case = allow_mixed_case
+
+        if phred_offset is None:
+            phred_offset = quality_filter.phred_offset if quality_filter else 33
+        self.phred_offset = phred_offset
+
+        self.pos = 0
+        self.id = None
+        self.seq = None
+        self.quals = None
+
+        # (quals, their scores), for the last record `quals_int` was asked for
+        self._quals_int = None
+
+        if self.fastq_file_path == '-':
+            self.file_pointer = sys.stdin
+        elif self.compressed:
+            self.file_pointer = gzip.open(self.fastq_file_path, 'rt')
+        else:
+            self.file_pointer = open(self.fastq_file_path)
+
+        head = self.file_pointer.read(1)
+        if not head == '@':
+            raise FastaLibError("File '%s' does not seem to be a FASTQ file." % self.fastq_file_path)
+
+        self.records = fastq_records(self.file_pointer, head=head)
+
+    def __next__(self):
+        """Reads the next record. If there is a quality filter, `seq` is the
+        trimmed sequence, or None if the read did not pass the filter."""
+        self.seq = None
+        self.quals = None
+
+        try:
+            self.id, seq, self.quals = next(self.records)
+        except StopIteration:
+            return False
+
+        if self.quality_filter:
+            seq = self.quality_filter.filter(seq, self.quals)
+
+        if seq is not None:
+            self.seq = seq if self.allow_mixed_case else seq.upper()
+
+        self.pos += 1
+        return True
+
+    @property
+    def quals_int(self):
+        """The quality scores of the current record, decoded when they are first
+        asked for, since most reads are only ever filtered by their quals."""
+        if self.quals is None:
+            return None
+
+        if not self._quals_int or self._quals_int[0] is not self.quals:
+            self._quals_int = (self.quals, [q - self.phred_offset for q in self.quals.encode('ascii')])
+
+        return self._quals_int[1]
+
+    def iter_records(self):
+        """Yields (pos, id, seq) tuples for the remaining records, just like
+        `SequenceSource.iter_records`. `seq` is None for reads that did not pass
+        the quality filter."""
+        upper = not self.allow_mixed_case
+        quality_filter = self.quality_filter
+
+        for self.id, seq, self.quals in self.records:
+            self.pos += 1
+            if quality_filter:
+                seq = quality_filter.filter(seq, self.quals)
+            self.seq = seq.upper() if upper and seq is not None else seq
+            yield self.pos, self.id, self.seq
+
+    def close(self):
+        self.file_pointer.close()
+
+    def reset(self):
+        self.pos = 0
+        self.id = None
+        self.seq = None
+        self.quals = None
+        self._quals_int = None
+        self.file_pointer.seek(0)
+        self.records = fastq_records(self.file_pointer)
+
+
 class QualSource:
     def __init__(self, quals_file_path, lazy_init=True):
         self.quals_file_path = quals_file_path
@@ -281,38 +884,23 @@ class QualSource:
         self.ids = []
 
         self.file_pointer = open(self.quals_file_path)
-        self.file_pointer.seek(0)
+        self.records = fasta_records(self.file_pointer, separator=' ')
 
         if self.lazy_init:
             self.total_quals = None
         else:
-            self.total_quals = len([l for l in self.file_pointer.readlines() if l.startswith('>')])
-            self.reset()
+            self.total_quals = count_records(self.quals_file_path)
 
 
     def __next__(self):
-        self.id = self.file_pointer.readline()[1:].strip()
         self.quals = None
         self.quals_int = None
 
-        qualscores = ''
-
-        while True:
-            line = self.file_pointer.readline()
-            if not line:
-                if len(qualscores):
-                    self.quals = qualscores.strip()
-                    self.quals_int = [int(q) for q in self.quals.split()]
-                    self.pos += 1
-                    return True
-                else:
-                    return False
-            if line.startswith('>'):
-                self.file_pointer.seek(self.file_pointer.tell() - len(line))
-                break
-            qualscores += ' ' + line.strip()
+        try:
+            self.id, self.quals = next(self.records)
+        except StopIteration:
+            return False
 
-        self.quals = qualscores.strip()
         self.quals_int = [int(q) for q in self.quals.split()]
         self.pos += 1
 
@@ -328,6 +916,7 @@ class QualSource:
         self.quals_int = None
         self.ids = []
         self.file_pointer.seek(0)
+        self.records = fasta_records(self.file_pointer, separator=' ')
 
 
 class FastaLibError(Exception):
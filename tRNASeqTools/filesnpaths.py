@@ -3,7 +3,6 @@
 """File/Path operations"""
 
 import os
-import mmap
 import time
 import shutil
 import tempfile
@@ -105,6 +104,21 @@ def is_file_fasta_formatted(file_path):
     return True
 
 
+def is_file_fastq_formatted(file_path):
+    is_file_exists(file_path)
+
+    try:
+        f = u.FastqSource(file_path)
+        next(f)
+    except u.FastaLibError as e:
+        raise FilesNPathsError("Someone is not happy with your FASTQ file '%s' (this is\
+                            what the lib says: '%s'." % (file_path, e))
+
+    f.close()
+
+    return True
+
+
 def is_program_exists(program):
     """adapted from http://stackoverflow.com/a/377028"""
     def is_exe(fpath):
@@ -136,14 +150,11 @@ def get_temp_file_path():
 
 
 def get_num_lines_in_file(file_path):
-    if os.stat(file_path).st_size == 0:
-        return 0
-
-    f = open(file_path, "rU+")
-    buf = mmap.mmap(f.fileno(), 0)
-    num_lines = 0
-    readline = buf.readline
-    while readline():
+    """Returns the number of lines in a plain or gzip-compressed file."""
+    num_lines, tail = u.count_in_file(file_path, b'\n', return_tail=True)
+
+    # the last line may not end with a new line
+    if tail and tail != b'\n':
         num_lines += 1
 
     return num_lines
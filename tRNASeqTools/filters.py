@@ -2,16 +2,30 @@
 
 import os
 import re
+import collections
 
+import tRNASeqTools.sinks as sinks
 import tRNASeqTools.extractor as extractor
 
+
+# Where the T-loop and acceptor guidelines are met in a seq. For a seq that
+# passes, `trailer_length` is the offset of the first acceptable window from
+# the 3' end. For a seq that fails, it is the offset of the first window with
+# the fewest misses (None if the seq is shorter than a window). `missed` are
+# the guideline tuples that are not met in that window.
+WindowMatch = collections.namedtuple('WindowMatch', ['passed', 'trailer_length', 'missed', 't_loop_seq', 'acceptor_seq'])
+NO_WINDOW_MATCH = WindowMatch(False, None, [], "", "")
+
 class IsTRNA:
 
-    def __init__(self, output_path):
+    def __init__(self, rejected_sink=None):
         self.ANTICODON_LOOP_GUIDELINES = [0, (('T'), ('A', 'G')), [], [], 0]
         self.allowed_pairings = {"G":("C", "T"), "T":("A", "G"), "C":("G"), "A":("T"), "N": ()}
         self.sub_size = 24
-        self.output_path = output_path
+        self.rejected_sink = rejected_sink or sinks.RejectedReadsSink()
+        self.missed = []
+        self.rejection = None
+        self.window_match = None
         self.T_LOOP_AND_ACCEPTOR_GUIDELINES = [[], 0, 0]
         self.SET_UP_FILTERS = {"Allow_one_mismatch_in_the_anticodon_pairs": self.change_anticodon_loop_guidelines(0, 1), #Canonical 
                                "Positions_34_and_37": self.change_anticodon_loop_guidelines(1, (('T'), ('A', 'G'))), #Canonical 
@@ -50,6 +64,11 @@ class IsTRNA:
             self.SET_UP_FILTERS[elem]
         if self.T_LOOP_AND_ACCEPTOR_GUIDELINES[2] == 0:
             self.T_LOOP_AND_ACCEPTOR_GUIDELINES[2] = (False, 0)
+
+        # work that is done on every seq before the filters run. only the ones
+        # an active filter depends on are run (see `set_up_precomputations`)
+        self.PRECOMPUTATIONS = {"D_region_shift": self.find_D_region_shift}
+        self.set_up_precomputations()
         
         FILTER_DESCRIPTIONS = {"Allow_one_mismatch_in_the_anticodon_pairs": "This filter allows a single mismatch when paring the anticodon stem",
                                "Positions_34_and_37": "This filter requires that position 34 (right before the anticodon) is a T, and position 37 (right after the anticodon) is an A or G",
@@ -75,27 +94,57 @@ class IsTRNA:
 
     def getFilters(self):
         return (self.FILTERS, self.SET_UP_FILTERS)
-    
-    def istRNA(self, seq, name):
-        problems = []
-        self.D_region_shift = 0
-        self.anticodon = []
-        self.name = name
 
+    def set_up_precomputations(self):
+        """Determines which precomputations the active filters depend on, with the
+        current guidelines. Called again if the guidelines change after init."""
+        self.FILTER_DEPENDENCIES = {"T_loop_and_acceptor_is_acceptable": ["D_region_shift"] if self.T_LOOP_AND_ACCEPTOR_GUIDELINES[2][0] else [],
+                                    "D_region_and_T_region_acceptable_length": ["D_region_shift"]}
+        self.precomputations = []
+        for filt in self.FILTERS:
+            for dependency in self.FILTER_DEPENDENCIES.get(filt, []):
+                if self.PRECOMPUTATIONS[dependency] not in self.precomputations:
+                    self.precomputations.append(self.PRECOMPUTATIONS[dependency])
+
+    def find_D_region_shift(self, seq):
         #Finding the length of a potential 5' trail past the acceptor stem (only relevant for non-canonical)
         for n in range(len(seq) - 43):
             misses = 0 
             for j in range(7):
-                if seq[j + n] not in self.allowed_pairings[seq[-5 - j]]:
+                if seq[j + n] not in self.allowed_pairings.get(seq[-5 - j], ()):
                     misses += 1
             if misses < self.T_LOOP_AND_ACCEPTOR_GUIDELINES[2][1]:
                 self.D_region_shift = n
+    
+    def write_rejected(self, seq, filter_name):
+        """Sends the seq to the rejected seqs sink, along with the guidelines it
+        missed on its way to `filter_name`."""
+        self.rejection = (filter_name, tuple(self.missed))
+        self.rejected_sink.write(self.name, seq, filter_name, self.rejection[1])
+
+    def istRNA(self, seq, name, window_match=None):
+        """Runs the filters on a seq, and returns a (problem, window_match) tuple,
+        where problem is the name of the first filter the seq fails ("" if it
+        passes all), and window_match is the WindowMatch of the T-loop and
+        acceptor (None if no filter needed it). If the WindowMatch of the seq is
+        already known, it can be passed as `window_match`."""
+        problems = []
+        self.D_region_shift = 0
+        self.anticodon = []
+        self.name = name
+        self.missed = []
+        self.rejection = None
+        self.window_match = window_match
+
+        for precomputation in self.precomputations:
+            precomputation(seq)
+
         #Running the filters
         for filt in self.FILTERS:
             if not self.FILTERS[filt](seq):
-                open(self.output_path + filt, "a").write(self.name + "\n" + seq + "\n")
-                return filt
-        return ""
+                self.write_rejected(seq, filt)
+                return filt, self.window_match
+        return "", self.window_match
 
     def change_anticodon_loop_guidelines(self, i, changeItTo):
         self.ANTICODON_LOOP_GUIDELINES[i] = changeItTo
@@ -128,37 +177,50 @@ class IsTRNA:
         else:
             self.T_LOOP_AND_ACCEPTOR_GUIDELINES[i].append(changeItTo)
 
-    def t_loop_and_acceptor(self, seq):
+    def find_t_loop_and_acceptor(self, seq, stop_at_first_pass=True):
+        """Slides a window from the 3' end of the seq towards its 5' end, and
+        returns the WindowMatch of the T-loop and acceptor guidelines."""
         length = len(seq)
-        shortestMissed = [0] * (len(self.T_LOOP_AND_ACCEPTOR_GUIDELINES[0]) + 1)
+        shortest = None
         for i in range(length - self.sub_size + 1):
             sub_str = seq[-(i + self.sub_size):(length - i)]
             missed = []
             for position_tuple in self.T_LOOP_AND_ACCEPTOR_GUIDELINES[0]:
                 if sub_str[position_tuple[0]] != position_tuple[1]:
                     missed.append(position_tuple)
-            if len(missed) < self.T_LOOP_AND_ACCEPTOR_GUIDELINES[1] + 1:
-                if self.T_LOOP_AND_ACCEPTOR_GUIDELINES[2][0]:
-                    misses = 0 
-                    for j in range(7):
-                        if seq[j + self.D_region_shift] not in self.allowed_pairings[seq[-5 - j]]:
-                            misses += 1
-                    if misses < self.T_LOOP_AND_ACCEPTOR_GUIDELINES[2][1]:
-                        return True
-                    
-                    open(self.output_path + "Require_Acceptor_Stem_Matching_with_one_mismatch", "a").write(self.name + "\n" + seq + "\n")
-        
-                else:
-                    return True
-            if len(missed) < len(shortestMissed):
-                shortestMissed = missed
-        for elem in shortestMissed:
+            if stop_at_first_pass and len(missed) < self.T_LOOP_AND_ACCEPTOR_GUIDELINES[1] + 1:
+                return WindowMatch(True, i, missed, sub_str[0:9], sub_str[-3:])
+            if shortest is None or len(missed) < len(shortest.missed):
+                shortest = WindowMatch(False, i, missed, sub_str[0:9], sub_str[-3:])
+        return shortest or NO_WINDOW_MATCH
+
+    def t_loop_and_acceptor(self, seq):
+        if self.window_match is None:
+            self.window_match = self.find_t_loop_and_acceptor(seq)
+
+        if self.window_match.passed:
+            if not self.T_LOOP_AND_ACCEPTOR_GUIDELINES[2][0]:
+                return True
+
+            misses = 0 
+            for j in range(7):
+                if seq[j + self.D_region_shift] not in self.allowed_pairings.get(seq[-5 - j], ()):
+                    misses += 1
+            if misses < self.T_LOOP_AND_ACCEPTOR_GUIDELINES[2][1]:
+                return True
+
+            # the acceptor stem does not depend on the window, so no other window
+            # would pass either
+            self.missed.append("Require_Acceptor_Stem_Matching_with_one_mismatch")
+            self.window_match = self.find_t_loop_and_acceptor(seq, stop_at_first_pass=False)
+
+        for elem in self.window_match.missed:
             fileName = "require_"
             if elem[0] > 0:
                 fileName += "T_Loop_"
             else:
                 fileName += "acceptor_"
             fileName += elem[1] + "_at_" +  str(elem[0])
-            open(self.output_path + fileName, "a").write(self.name + "\n" + seq + "\n")
-        open(self.output_path + "Allow_one_mismatch_in_T-loop_and_acceptor", "a").write(self.name + "\n" + seq + "\n")
+            self.missed.append(fileName)
+        self.missed.append("Allow_one_mismatch_in_T-loop_and_acceptor")
         return False
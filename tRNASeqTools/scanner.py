@@ -0,0 +1,111 @@
+# -*- coding: utf-8
+# pylint: disable=line-too-long
+"""Vectorized T-loop and acceptor window scan for blocks of seqs."""
+
+import numpy
+
+import tRNASeqTools
+from tRNASeqTools.errors import ConfigError
+from tRNASeqTools.filters import WindowMatch, NO_WINDOW_MATCH
+
+__author__ = "Steven Cui"
+__copyright__ = "Copyright 2017, Meren Lab"
+__credits__ = []
+__license__ = "GPL 3.0"
+__version__ = tRNASeqTools.__version__
+__maintainer__ = "Steven Cui"
+__email__ = "stevencui729@gmail.com"
+
+
+class TLoopAndAcceptorScanner:
+    """Finds the T-loop and acceptor window of many seqs at once.
+
+    This does the same thing as `filters.IsTRNA.find_t_loop_and_acceptor`:
+    a window of `sub_size` nucleotides slides from the 3' end of each seq
+    towards its 5' end, and every `(position, base)` guideline is checked in
+    every window. Here a block of seqs is encoded as a 2-D uint8 array in which
+    all seqs are aligned at their 3' ends, so each guideline is checked at every
+    window offset of every seq with a single array comparison.
+    """
+
+    def __init__(self, t_loop_and_acceptor_guidelines, sub_size=24):
+        position_tuples, allowed_mismatches, acceptor_stem_matching = t_loop_and_acceptor_guidelines
+
+        if acceptor_stem_matching[0]:
+            raise ConfigError("The vectorized T-loop and acceptor scan does not know how to match the acceptor stem.")
+
+        self.sub_size = sub_size
+        self.position_tuples = list(position_tuples)
+        self.allowed_mismatches = allowed_mismatches
+
+        # positions within the window, and the bases expected there
+        self.window_positions = numpy.array([p if p >= 0 else sub_size + p for p, base in self.position_tuples], dtype=numpy.int64)
+        self.window_bases = numpy.array([ord(base) for p, base in self.position_tuples], dtype=numpy.uint8)
+
+
+    def encode(self, seqs):
+        """Returns a (num seqs x max length) uint8 array of seqs aligned at their
+        3' ends (padded with zeros at the 5' end), and the array of lengths."""
+        lengths = numpy.array([len(seq) for seq in seqs], dtype=numpy.int64)
+        max_length = int(lengths.max()) if len(seqs) else 0
+        encoded = numpy.zeros((len(seqs), max_length), dtype=numpy.uint8)
+
+        if lengths.sum():
+            # a character that is not ASCII becomes a '?' (so it still takes one
+            # column), which never matches a base
+            flat = numpy.frombuffer(''.join(seqs).encode('ascii', 'replace'), dtype=numpy.uint8)
+            rows = numpy.repeat(numpy.arange(len(seqs)), lengths)
+            starts = numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+            columns = numpy.arange(len(flat)) - starts + numpy.repeat(max_length - lengths, lengths)
+            encoded[rows, columns] = flat
+
+        return encoded, lengths
+
+
+    def scan(self, seqs):
+        """Scans a list of (upper case) seqs, and returns a list of
+        `filters.WindowMatch` tuples, one for each seq."""
+        if not seqs:
+            return []
+
+        encoded, lengths = self.encode(seqs)
+        num_seqs, max_length = encoded.shape
+        num_offsets = max_length - self.sub_size + 1
+
+        if num_offsets < 1:
+            return [NO_WINDOW_MATCH for seq in seqs]
+
+        offsets = numpy.arange(num_offsets)
+
+        # mismatches[g, s, i] is True if guideline g is not met by seq s in the
+        # window i nucleotides away from its 3' end
+        mismatches = numpy.empty((len(self.position_tuples), num_seqs, num_offsets), dtype=bool)
+        for g in range(len(self.position_tuples)):
+            columns = max_length - self.sub_size + self.window_positions[g] - offsets
+            numpy.not_equal(encoded[:, columns], self.window_bases[g], out=mismatches[g])
+
+        num_mismatches = mismatches.sum(axis=0)
+
+        # windows can't go past the 5' end of a seq
+        valid = offsets[numpy.newaxis, :] <= (lengths - self.sub_size)[:, numpy.newaxis]
+        num_mismatches[~valid] = len(self.position_tuples) + 1
+
+        passing = num_mismatches <= self.allowed_mismatches
+        passed = passing.any(axis=1)
+        chosen_offsets = numpy.where(passed, passing.argmax(axis=1), num_mismatches.argmin(axis=1))
+        has_window = valid[:, 0]
+
+        missed_at_chosen_offsets = mismatches[:, numpy.arange(num_seqs), chosen_offsets].T
+
+        results = []
+        for s in range(num_seqs):
+            if not has_window[s]:
+                results.append(NO_WINDOW_MATCH)
+                continue
+
+            seq, offset = seqs[s], int(chosen_offsets[s])
+            window_start = len(seq) - offset - self.sub_size
+            missed = [self.position_tuples[g] for g in numpy.flatnonzero(missed_at_chosen_offsets[s])]
+            results.append(WindowMatch(bool(passed[s]), offset, missed, seq[window_start:window_start + 9], seq[len(seq) - offset - 3:len(seq) - offset]))
+
+        return results
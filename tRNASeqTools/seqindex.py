@@ -0,0 +1,88 @@
+# -*- coding: utf-8
+# pylint: disable=line-too-long
+"""A k-mer index to find the seqs a (shorter) seq is a subsequence of."""
+
+import bisect
+
+import tRNASeqTools
+
+__author__ = "Steven Cui"
+__copyright__ = "Copyright 2017, Meren Lab"
+__credits__ = []
+__license__ = "GPL 3.0"
+__version__ = tRNASeqTools.__version__
+__maintainer__ = "Steven Cui"
+__email__ = "stevencui729@gmail.com"
+
+
+class SubsequenceIndex:
+    """Answers `[i for i, s in enumerate(sequences) if seq in s]` without going
+    through all of `sequences` for every `seq`.
+
+    The seqs are concatenated into a single string, and the k-mers that start
+    every `step` nucleotides into each seq are indexed by their position in that
+    string. Wherever a query seq occurs in a seq, one of its first `step` k-mers
+    is aligned with an indexed one, so looking those up gives every candidate
+    position, and each candidate is confirmed with a string comparison. Queries
+    that are shorter than `k + step - 1` can't be looked up that way, and are
+    tested against every seq instead.
+    """
+
+    def __init__(self, sequences, k=10, step=5):
+        self.k = k
+        self.step = step
+        self.min_query_length = k + step - 1
+
+        self.sequences = list(sequences)
+
+        # where each seq starts in the concatenated string
+        self.starts = []
+        position = 0
+        for seq in self.sequences:
+            self.starts.append(position)
+            position += len(seq) + 1
+
+        self.concatenated = '\n'.join(self.sequences)
+
+        self.kmers = {}
+        for start, seq in zip(self.starts, self.sequences):
+            for i in range(0, len(seq) - k + 1, step):
+                kmer = seq[i:i + k]
+                if kmer in self.kmers:
+                    self.kmers[kmer].append(start + i)
+                else:
+                    self.kmers[kmer] = [start + i]
+
+
+    def __len__(self):
+        return len(self.sequences)
+
+
+    def find(self, seq):
+        """Returns the (sorted) indexes of the seqs `seq` is a subsequence of."""
+        if len(seq) < self.min_query_length:
+            return [i for i, s in enumerate(self.sequences) if seq in s]
+
+        k, concatenated, starts, sequences = self.k, self.concatenated, self.starts, self.sequences
+
+        found = set()
+        for j in range(self.step):
+            for position in self.kmers.get(seq[j:j + k], ()):
+                start = position - j
+                i = bisect.bisect_right(starts, position) - 1
+
+                if start >= starts[i] and start + len(seq) <= starts[i] + len(sequences[i]) and concatenated.startswith(seq, start):
+                    found.add(i)
+
+        return sorted(found)
+
+
+    def find_many(self, seqs):
+        """Yields the result of `find` for each seq in `seqs`, in order. Reads
+        tend to come in many copies, so each distinct seq is only looked up once."""
+        found = {}
+        for seq in seqs:
+            if seq not in found:
+                found[seq] = self.find(seq)
+
+            yield found[seq]
@@ -0,0 +1,163 @@
+# -*- coding: utf-8
+# pylint: disable=line-too-long
+"""Sinks for the reads the tRNA filters reject."""
+
+import os
+import gzip
+
+import tRNASeqTools
+from tRNASeqTools.errors import ConfigError
+
+__author__ = "Steven Cui"
+__copyright__ = "Copyright 2017, Meren Lab"
+__credits__ = []
+__license__ = "GPL 3.0"
+__version__ = tRNASeqTools.__version__
+__maintainer__ = "Steven Cui"
+__email__ = "stevencui729@gmail.com"
+
+
+# the ways rejected reads can be stored
+REJECTED_READS_FORMATS = ['db', 'fasta', 'fasta.gz', 'none']
+
+# rejected reads of a filter are written out once this many bytes of them
+# are waiting in its buffer
+REJECTED_READS_BLOCK_SIZE = 1024 * 1024
+
+
+class RejectedReadsSink:
+    """Takes the reads each filter rejects, and throws them away. It is
+    useful when only the counts in the stats table are needed.
+
+    Each rejected read comes with the name of the filter that rejected it, and
+    the names of the guidelines it missed on its way there (i.e., the T-loop
+    and acceptor positions that did not match)."""
+
+    def open(self, filter_names):
+        """Prepares the sink for the rejections of `filter_names`."""
+        pass
+
+
+    def write(self, read_id, seq, filter_name, missed=()):
+        pass
+
+
+    def close(self):
+        pass
+
+
+class RejectedReadsCollector(RejectedReadsSink):
+    """Keeps (read_id, seq, filter_name, missed) tuples in memory, so they can
+    be sent elsewhere (i.e., from a worker process to the one that writes them)."""
+
+    def __init__(self):
+        self.rejected = []
+
+
+    def write(self, read_id, seq, filter_name, missed=()):
+        self.rejected.append((read_id, seq, filter_name, tuple(missed)))
+
+
+    def pop(self):
+        """Returns the rejections collected so far, and forgets about them."""
+        rejected, self.rejected = self.rejected, []
+        return rejected
+
+
+class DatabaseRejectedReadsSink(RejectedReadsSink):
+    """Stores rejected reads in the rejected reads table of the profile database
+    that is being populated through `profile_table` (a
+    `dbops.TableFortRNASequences` instance), one row per read."""
+
+    def __init__(self, profile_table):
+        self.profile_table = profile_table
+
+
+    def write(self, read_id, seq, filter_name, missed=()):
+        self.profile_table.add_rejected_sequence(read_id, seq, filter_name, missed)
+
+
+class FASTARejectedReadsSink(RejectedReadsSink):
+    """Writes the reads each filter rejects into a FASTA file of its own in
+    `output_dir`, named after the filter (with a '.gz' suffix if `compress`).
+    A read also goes into the file of every guideline it missed.
+
+    There is one handle per filter, and the reads are buffered in memory and
+    written out in blocks of about `block_size` bytes.
+    """
+
+    def __init__(self, output_dir, compress=False, block_size=REJECTED_READS_BLOCK_SIZE):
+        self.output_dir = output_dir
+        self.compress = compress
+        self.block_size = block_size
+
+        self.handles = {}
+        self.buffers = {}
+        self.buffer_sizes = {}
+
+
+    def get_path(self, filter_name):
+        return os.path.join(self.output_dir, filter_name + ('.gz' if self.compress else ''))
+
+
+    def open_handle(self, filter_name):
+        path = self.get_path(filter_name)
+        self.handles[filter_name] = gzip.open(path, 'wb') if self.compress else open(path, 'wb')
+        self.buffers[filter_name] = []
+        self.buffer_sizes[filter_name] = 0
+
+
+    def open(self, filter_names):
+        """Creates an empty file for each filter, so every filter has one even if
+        it rejects nothing."""
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        for filter_name in filter_names:
+            if filter_name not in self.handles:
+                self.open_handle(filter_name)
+
+
+    def write(self, read_id, seq, filter_name, missed=()):
+        entry = read_id + "\n" + seq + "\n"
+
+        for file_name in list(missed) + [filter_name]:
+            if file_name not in self.handles:
+                self.open_handle(file_name)
+
+            self.buffers[file_name].append(entry)
+            self.buffer_sizes[file_name] += len(entry)
+
+            if self.buffer_sizes[file_name] >= self.block_size:
+                self.flush(file_name)
+
+
+    def flush(self, filter_name):
+        if self.buffers[filter_name]:
+            self.handles[filter_name].write(''.join(self.buffers[filter_name]).encode('utf-8'))
+            self.buffers[filter_name] = []
+            self.buffer_sizes[filter_name] = 0
+
+
+    def close(self):
+        for filter_name in self.handles:
+            self.flush(filter_name)
+            self.handles[filter_name].close()
+
+        self.handles = {}
+
+
+def get_rejected_reads_sink(output_format, output_dir=None, profile_table=None):
+    """Returns the sink for `output_format` (one of REJECTED_READS_FORMATS). FASTA
+    files go into `output_dir`, and the 'db' format needs the `profile_table`."""
+    if output_format == 'db':
+        return DatabaseRejectedReadsSink(profile_table)
+    elif output_format == 'fasta':
+        return FASTARejectedReadsSink(output_dir)
+    elif output_format == 'fasta.gz':
+        return FASTARejectedReadsSink(output_dir, compress=True)
+    elif output_format == 'none':
+        return RejectedReadsSink()
+    else:
+        raise ConfigError("'%s' is not a format rejected reads can be stored in. Please pick one of these: %s."\
+                                                    % (output_format, ', '.join(REJECTED_READS_FORMATS)))
@@ -4,8 +4,9 @@
 
 import os
 import sys
+import itertools
 import collections
-import Levenshtein as lev
+import multiprocessing
 
 import tRNASeqTools
 import tRNASeqTools.fastalib as u
@@ -15,6 +16,8 @@ import tRNASeqTools.terminal as terminal
 import tRNASeqTools.extractor as extractor
 import tRNASeqTools.filesnpaths as filesnpaths
 import tRNASeqTools.filters as filters
+import tRNASeqTools.sinks as sinks
+import tRNASeqTools.scanner as scanner
 
 from tRNASeqTools.errors import ConfigError
 
@@ -30,16 +33,21 @@ __email__ = "a.murat.eren@gmail.com"
 
 pp = terminal.pretty_print
 
+# seqs longer than this are scanned one by one rather than in blocks, so a few
+# very long reads don't blow up the size of the arrays the scanner works with
+MAX_BLOCK_SCAN_SEQ_LENGTH = 200
+
 class SeqSpecs:
-    """Class to store seq information during sort."""
+    """Class to store seq information during sort. It only holds what goes into
+    the profile table, and uses slots to keep millions of them cheap."""
+
+    __slots__ = ['length', 'seq', 'full_length', 't_loop_seq', 'acceptor_seq',
+                 'three_trailer', 'trailer_length', 'anticodon']
 
     def __init__(self):
         """Initializes seq information categories."""
         self.length = 0
-        self.t_loop_error = True
-        self.acceptor_error = True
         self.seq = ""
-        self.seq_sub = ""
         self.full_length = False
         self.t_loop_seq = ""
         self.acceptor_seq = ""
@@ -50,46 +58,76 @@ class SeqSpecs:
 
     def gen_sql_query_info_tuple(self, id):
         """Generates tuple of values to add into database to use in SQL query."""
-        info_string_list = []
-        info_string_list.append(id)
-        info_string_list.append(self.seq)
-
-        if self.trailer_length == 0:
-            info_string_list.append(None)
-        else:
-            info_string_list.append(self.three_trailer)
-
-        info_string_list.append(self.t_loop_seq)
-        info_string_list.append(self.acceptor_seq)
-        info_string_list.append(str(self.full_length))
-        info_string_list.append(str(self.length))
-        info_string_list.append(str(self.trailer_length))
-
-        if len(self.anticodon) == 0:
-            info_string_list.append(None)
-        else:
-            info_string_list.append(self.anticodon)
-
-        return tuple(info_string_list)
+        return (id,
+                self.seq,
+                self.three_trailer if self.trailer_length else None,
+                self.t_loop_seq,
+                self.acceptor_seq,
+                int(self.full_length),
+                self.length,
+                self.trailer_length,
+                self.anticodon if self.anticodon else None)
+
+
+    def gen_anticodon_summary_key(self):
+        """Generates the (anticodon, full_length, seq_length, has_trailer) tuple
+        the seq is counted under in the anticodon summary table."""
+        return (self.anticodon if self.anticodon else None,
+                int(self.full_length),
+                self.length,
+                int(self.trailer_length > 0))
 
 class Sorter:
     def __init__(self, args):
         """Class that handles the sorting of the seqs."""
 
+        self.args = args
+
         A = lambda x: args.__dict__[x] if x in args.__dict__ else None
         self.sample_name = A('sample_name')
         self.input_fasta_path = A('input_fasta')
         self.output_db_path = A('output_db_path')
+        self.num_threads = A('num_threads') or 1
+        self.chunk_size = A('chunk_size') or 5000
+        self.dereplicate = A('dereplicate')
+        self.max_memory = A('max_memory') or '256M'
+        self.write_buffer_size = A('write_buffer_size')
+        self.trim_quality = A('trim_quality')
+        self.min_mean_quality = A('min_mean_quality')
+        self.filtered_sequences_format = A('filtered_sequences_format') or 'db'
+        self.input_format = None
 
         self.run = terminal.Run()
         self.progress = terminal.Progress()
 
         self.stats_dict = collections.Counter()
 
+        # (anticodon, full_length, seq_length, has_trailer) -> number of seqs,
+        # for the anticodon summary table
+        self.anticodon_summary = collections.Counter()
+
         self.extractor = extractor.Extractor()
         self.db = None
         self.seq_count_dict = {}
 
+        self.is_trna = None
+        self.rejected_sink = None
+        self.t_loop_guidelines = None
+        self.scanner = None
+
+        # seq -> (SeqSpecs or None, stats keys to increment, (filter, missed
+        # guidelines) tuple if rejected) for every distinct seq classified so far
+        # when dereplicating, least recently used first. the entries that were
+        # used the longest time ago are evicted to keep its estimated size under
+        # `max_classification_cache_bytes` (if set)
+        self.classification_cache = collections.OrderedDict()
+        self.classification_cache_bytes = 0
+        self.max_classification_cache_bytes = None
+        self.num_classification_cache_evictions = 0
+
+        # the part of `max_memory` the write buffer can take
+        self.max_write_buffer_bytes = None
+
 
     def sanity_check(self):
         """Takes command line arguments from args and assigns input/output file
@@ -113,39 +151,60 @@ class Sorter:
             self.run.warning('I just replaced all "-" characters with "_" characters in your sample name. This program\
                               does not like "-" characters in sample names.')
 
+        if self.num_threads < 1:
+            raise ConfigError('The number of threads must be a positive integer.')
+
+        if self.chunk_size < 1:
+            raise ConfigError('The chunk size must be a positive integer.')
+
+        self.max_memory = utils.get_num_bytes_from_human_readable(self.max_memory)
+        self.set_memory_budgets(self.max_memory)
+
+        if self.write_buffer_size is not None and self.write_buffer_size < 1:
+            raise ConfigError('The write buffer size must be a positive integer.')
+
+        if self.filtered_sequences_format not in sinks.REJECTED_READS_FORMATS:
+            raise ConfigError("'%s' is not a format filtered sequences can be stored in. Please pick one of these: %s."\
+                                                    % (self.filtered_sequences_format, ', '.join(sinks.REJECTED_READS_FORMATS)))
+
         utils.check_sample_id(self.sample_name)
         filesnpaths.is_output_file_writable(self.output_db_path)
-        filesnpaths.is_file_fasta_formatted(self.input_fasta_path)
 
-        self.input_fasta_path = os.path.abspath(self.input_fasta_path)
+        # '-' means the input is coming from stdin
+        if self.input_fasta_path != '-':
+            filesnpaths.is_file_exists(self.input_fasta_path)
+
+        self.input_format = u.get_sequence_file_format(self.input_fasta_path)
+        if not self.input_format:
+            raise ConfigError("The input file '%s' does not seem to be a FASTA or a FASTQ file." % self.input_fasta_path)
+
+        if self.input_format == 'fasta' and (self.trim_quality is not None or self.min_mean_quality is not None):
+            raise ConfigError("Quality filtering is only possible when the input is a FASTQ file.")
+
+        if self.input_fasta_path != '-':
+            if self.input_format == 'fasta':
+                filesnpaths.is_file_fasta_formatted(self.input_fasta_path)
+            else:
+                filesnpaths.is_file_fastq_formatted(self.input_fasta_path)
+
+            self.input_fasta_path = os.path.abspath(self.input_fasta_path)
 
 
-    def check_divergence_pos(self, cur_seq_specs):
-        """Takes a SeqSpecs class and updates statistics on divergence
+    def check_divergence_pos(self, t_loop_seq):
+        """Takes the T-loop of a passed seq and updates statistics on divergence
         position.
         """
-        if cur_seq_specs.t_loop_error:
-            self.stats_dict['t_loop_divergence'] += 1
-            if cur_seq_specs.seq_sub[0] != "G":
-                self.stats_dict['div_at_0'] += 1
-            elif cur_seq_specs.seq_sub[1] != "T":
-                self.stats_dict['div_at_1'] += 1
-            elif cur_seq_specs.seq_sub[2] != "T":
-                self.stats_dict['div_at_2'] += 1
-            elif cur_seq_specs.seq_sub[3] != "C":
-                self.stats_dict['div_at_3'] += 1
-            elif cur_seq_specs.seq_sub[8] != "C":
-                self.stats_dict['div_at_8'] += 1
-        elif cur_seq_specs.acceptor_error:
-            self.stats_dict['acceptor_divergence'] += 1
-            if cur_seq_specs.seq_sub[-3] != "C":
-                self.stats_dict['div_at_neg_3'] += 1
-            elif cur_seq_specs.seq_sub[-2] != "C":
-                self.stats_dict['div_at_neg_2'] += 1
-            elif cur_seq_specs.seq_sub[-1] != "A":
-                self.stats_dict['div_at_neg_1'] += 1
-        else:
-            self.stats_dict['no_divergence'] += 1
+        self.stats_dict['t_loop_divergence'] += 1
+        if t_loop_seq[0] != "G":
+            self.stats_dict['div_at_0'] += 1
+        elif t_loop_seq[1] != "T":
+            self.stats_dict['div_at_1'] += 1
+        elif t_loop_seq[2] != "T":
+            self.stats_dict['div_at_2'] += 1
+        elif t_loop_seq[3] != "C":
+            self.stats_dict['div_at_3'] += 1
+        elif t_loop_seq[8] != "C":
+            self.stats_dict['div_at_8'] += 1
 
 
     def check_full_length(self, cur_seq_specs):
@@ -197,14 +256,13 @@ class Sorter:
         return cur_seq_specs
 
 
-    def handle_pass_seq(self, cur_seq_specs, i):
+    def handle_pass_seq(self, cur_seq_specs, window_match):
         """Consdolidates all the methods run specifically for a confirmed passed
         sequence.
         """
         self.stats_dict['total_passed'] += 1
-        if cur_seq_specs.seq_sub != "":
-            self.check_divergence_pos(cur_seq_specs)
-        cur_seq_specs = self.split_3_trailer(cur_seq_specs, i)
+        self.check_divergence_pos(window_match.t_loop_seq)
+        cur_seq_specs = self.split_3_trailer(cur_seq_specs, window_match.trailer_length)
         cur_seq_specs = self.check_full_length(cur_seq_specs)
         cur_seq_specs = self.assign_anticodons(cur_seq_specs)
         return cur_seq_specs
@@ -218,6 +276,204 @@ class Sorter:
         return tuple(info_string_list)
 
 
+    def init_filters(self, rejected_sink):
+        """Sets up the tRNA filters that send rejected seqs to `rejected_sink`."""
+        self.rejected_sink = rejected_sink
+        self.is_trna = filters.IsTRNA(rejected_sink)
+        self.t_loop_guidelines = self.is_trna.get_t_loop_and_acceptor_guidelines()
+
+        # the block scanner can't match the acceptor stem
+        if not self.t_loop_guidelines[2][0]:
+            self.scanner = scanner.TLoopAndAcceptorScanner(self.t_loop_guidelines)
+
+
+    def classify(self, seq, read_id, window_match=None):
+        """Runs the filters on a single (upper case) seq, and returns a SeqSpecs
+        object if the seq is a tRNA, or None otherwise. Stats are updated as a
+        side effect. `window_match` is the `filters.WindowMatch` of the seq, if it
+        is already known.
+
+        When dereplicating, each distinct seq goes through the filters only once,
+        and every repeat of it reuses the cached result, stats and rejections.
+        """
+        if not self.dereplicate:
+            return self.run_filters(seq, read_id, window_match)
+
+        if seq in self.classification_cache:
+            cur_seq_specs, stats_keys, rejection, entry_bytes = self.classification_cache[seq]
+            if self.max_classification_cache_bytes:
+                self.classification_cache.move_to_end(seq)
+            for key in stats_keys:
+                self.stats_dict[key] += 1
+            if rejection:
+                self.rejected_sink.write(read_id, seq, rejection[0], rejection[1])
+            return cur_seq_specs
+
+        stats_dict = self.stats_dict
+        self.stats_dict = collections.Counter()
+        try:
+            cur_seq_specs = self.run_filters(seq, read_id, window_match)
+            self.cache_classification(seq, cur_seq_specs, tuple(self.stats_dict.elements()), self.is_trna.rejection)
+        finally:
+            stats_dict.update(self.stats_dict)
+            self.stats_dict = stats_dict
+
+        return cur_seq_specs
+
+
+    def set_memory_budgets(self, max_memory, num_processes=1):
+        """Splits `max_memory` (in bytes) between the write buffer and, when
+        dereplicating, the classification caches of `num_processes` processes,
+        so that together they stay within it."""
+        if self.dereplicate:
+            self.max_write_buffer_bytes = max_memory // 2
+            self.max_classification_cache_bytes = (max_memory - self.max_write_buffer_bytes) // num_processes
+        else:
+            self.max_write_buffer_bytes = max_memory
+            self.max_classification_cache_bytes = None
+
+
+    def cache_classification(self, seq, cur_seq_specs, stats_keys, rejection):
+        """Adds the classification of a distinct seq to the cache, and evicts the
+        least recently used entries if it would not fit in
+        `max_classification_cache_bytes` otherwise. An evicted seq is only
+        classified again, so results stay the same."""
+
+        # the key, the entry and everything in it, and everything in the SeqSpecs
+        entry_bytes = utils.get_approximate_size_in_bytes(seq, stats_keys, rejection, (None, ) * 4)
+        if cur_seq_specs:
+            entry_bytes += utils.get_approximate_size_in_bytes(cur_seq_specs, *[getattr(cur_seq_specs, a) for a in SeqSpecs.__slots__])
+
+        if self.max_classification_cache_bytes:
+            while self.classification_cache and self.classification_cache_bytes + entry_bytes > self.max_classification_cache_bytes:
+                self.classification_cache_bytes -= self.classification_cache.popitem(last=False)[1][3]
+                self.num_classification_cache_evictions += 1
+
+        self.classification_cache[seq] = (cur_seq_specs, stats_keys, rejection, entry_bytes)
+        self.classification_cache_bytes += entry_bytes
+
+
+    def run_filters(self, seq, read_id, window_match=None):
+        """Does the actual classification work for `classify`."""
+        self.stats_dict['total_seqs'] += 1
+        length = len(seq)
+        cur_seq_specs = SeqSpecs()
+        cur_seq_specs.length = length
+
+        problem, window_match = self.is_trna.istRNA(seq, read_id, window_match)
+        if problem != "":
+            self.stats_dict[problem] += 1
+            self.stats_dict['total_rejected'] += 1
+            return None
+
+        # the window match tells us the length of the trailer
+        if window_match is None:
+            window_match = self.is_trna.find_t_loop_and_acceptor(seq)
+
+        if not window_match.passed:
+            return None
+
+        for elem in window_match.missed:
+            self.stats_dict[str(elem)] += 1
+        cur_seq_specs.seq = seq
+        cur_seq_specs.t_loop_seq = window_match.t_loop_seq
+        cur_seq_specs.acceptor_seq = window_match.acceptor_seq
+        return self.handle_pass_seq(cur_seq_specs, window_match)
+
+
+    def classify_chunk(self, chunk):
+        """Takes a list of (pos, read_id, seq) tuples, and returns a list of
+        (pos, SeqSpecs) tuples for the ones that are tRNAs.
+        """
+        results = []
+        chunk = [(pos, read_id, seq.upper() if seq is not None else None) for pos, read_id, seq in chunk]
+
+        # scanning the T-loop and acceptor windows of all (distinct, not yet classified) seqs of the
+        # chunk in one go
+        window_matches = {}
+        if self.scanner:
+            seqs_to_scan = set([seq for pos, read_id, seq in chunk if seq is not None and len(seq) <= MAX_BLOCK_SCAN_SEQ_LENGTH])
+            if self.dereplicate:
+                seqs_to_scan.difference_update(self.classification_cache)
+            seqs_to_scan = list(seqs_to_scan)
+            window_matches = dict(zip(seqs_to_scan, self.scanner.scan(seqs_to_scan)))
+
+        for pos, read_id, seq in chunk:
+            if seq is None:
+                # the read did not pass the quality filter
+                self.stats_dict['total_seqs'] += 1
+                self.stats_dict['Low_quality'] += 1
+                self.stats_dict['total_rejected'] += 1
+                continue
+
+            cur_seq_specs = self.classify(seq, read_id, window_matches.get(seq))
+            if cur_seq_specs:
+                results.append((pos, cur_seq_specs))
+
+        return results
+
+
+    def count_input_reads(self):
+        """Returns the number of reads in the input file (which is cheap to
+        count, see `fastalib.count_records`), or None if the input is stdin."""
+        if self.input_fasta_path == '-':
+            return None
+
+        if self.input_format == 'fastq':
+            return filesnpaths.get_num_lines_in_file(self.input_fasta_path) // 4
+        else:
+            return u.count_records(self.input_fasta_path)
+
+
+    def gen_chunks(self, input_fasta):
+        """Yields lists of (pos, read_id, seq) tuples from the input FASTA."""
+        records = input_fasta.iter_records()
+
+        while True:
+            chunk = list(itertools.islice(records, self.chunk_size))
+
+            if not chunk:
+                return
+
+            yield chunk
+
+
+    def classify_chunks_in_parallel(self, chunks):
+        """Distributes chunks to a pool of worker processes, merges the stats
+        they send back, and yields their results in input order. Workers send
+        their rejected seqs back too, which are passed on to the rejected seqs
+        sink here, so they end up in the same order as they would in a serial
+        run.
+        """
+        collect_rejected = self.filtered_sequences_format != 'none'
+        pool = multiprocessing.Pool(self.num_threads, initializer=_init_worker, initargs=(self.args, collect_rejected))
+
+        # we don't want to read the entire input into the queue of the pool, so
+        # we only keep a few chunks per worker in flight at any given time
+        max_chunks_in_flight = self.num_threads * 2
+        chunks_in_flight = collections.deque()
+
+        def collect():
+            results, stats_dict, extractor_stats, rejected = chunks_in_flight.popleft().get()
+            for read_id, seq, filter_name, missed in rejected:
+                self.rejected_sink.write(read_id, seq, filter_name, missed)
+            self.stats_dict.update(stats_dict)
+            self.extractor.extractor_stats.merge(extractor_stats)
+            return results
+
+        try:
+            for chunk in chunks:
+                chunks_in_flight.append(pool.apply_async(_classify_chunk, (chunk, )))
+                if len(chunks_in_flight) >= max_chunks_in_flight:
+                    yield collect()
+
+            while chunks_in_flight:
+                yield collect()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
     def process(self):
         """Run the sorter."""
 
@@ -228,95 +484,76 @@ class Sorter:
         profile_db = dbops.tRNADatabase(self.output_db_path)
         profile_db.create(meta_values={'sample_name': self.sample_name})
 
-        # a list buffer to keep results
-        results_buffer = []
-
-        # an arbitrary max size to store and reset the buffer
-        memory_max = 2000000
+        table_for_tRNA_seqs = dbops.TableFortRNASequences(self.output_db_path,
+                                                          max_buffer_rows=self.write_buffer_size,
+                                                          max_buffer_bytes=self.max_write_buffer_bytes)
 
-        # the filteredSequences directory
+        # the filteredSequences directory, if rejected seqs are not going into
+        # the database
         slash_index = self.output_db_path.rfind("/")
         if slash_index == -1:
             slash_index = self.output_db_path.rfind(".")
         folder_output_path = self.output_db_path[:slash_index] + "/filteredSequences/"
-        if not os.path.exists(folder_output_path):
-            os.makedirs(folder_output_path)
-        
-        is_trna = filters.IsTRNA(folder_output_path)
-        t_loop_guidelines = is_trna.get_t_loop_and_acceptor_guidelines()
-        run_filters = is_trna.getFilters()
-        for i in range(2):
-            for elem in run_filters[i]:
-                temp = open(folder_output_path + elem, "w")
-                temp.write("")
-        
-        sub_size = 24
 
-        input_fasta = u.SequenceSource(self.input_fasta_path)
+        self.init_filters(sinks.get_rejected_reads_sink(self.filtered_sequences_format, folder_output_path, table_for_tRNA_seqs))
+        run_filters = self.is_trna.getFilters()
+        self.rejected_sink.open(list(run_filters[0]) + list(run_filters[1]))
+
+        # seqs are upper-cased in `classify_chunk`
+        if self.input_format == 'fastq':
+            quality_filter = None
+            if self.trim_quality is not None or self.min_mean_quality is not None:
+                quality_filter = u.QualityFilter(self.trim_quality, self.min_mean_quality)
+            input_fasta = u.FastqSource(self.input_fasta_path, quality_filter=quality_filter, allow_mixed_case=True)
+        else:
+            input_fasta = u.SequenceSource(self.input_fasta_path, allow_mixed_case=True)
 
         self.run.info('Hi', terminal.get_date(), mc='green')
         self.run.info('Sample name', self.sample_name)
-        self.run.info('Input FASTA', self.input_fasta_path)
-
-        table_for_tRNA_seqs = dbops.TableFortRNASequences(self.output_db_path)
+        self.run.info('Input %s' % self.input_format.upper(), self.input_fasta_path)
+        num_input_reads = self.count_input_reads()
+        if num_input_reads is not None:
+            self.run.info('Num raw reads', num_input_reads)
+        if self.input_format == 'fastq':
+            self.run.info('Quality trimming threshold', self.trim_quality)
+            self.run.info('Min mean quality', self.min_mean_quality)
+        self.run.info('Num threads', self.num_threads)
+        self.run.info('Filtered sequences', {'db': 'in the profile database',
+                                             'none': 'not stored'}.get(self.filtered_sequences_format,
+                                                                       '%s (%s)' % (folder_output_path, self.filtered_sequences_format)))
+        self.run.info('Max write buffer size', '%s%s' % (utils.human_readable_file_size(self.max_write_buffer_bytes),
+                                                        ' or %s rows' % pp(self.write_buffer_size) if self.write_buffer_size else ''))
+
+        chunks = self.gen_chunks(input_fasta)
+        if self.num_threads > 1:
+            chunk_results = self.classify_chunks_in_parallel(chunks)
+        else:
+            chunk_results = map(self.classify_chunk, chunks)
 
         self.progress.new('Profiling tRNAs')
         self.progress.update('...')
-        while next(input_fasta):
-            
-            self.stats_dict['total_seqs'] += 1
-            seq = input_fasta.seq.upper()
-            length = len(seq)
-            cur_seq_specs = SeqSpecs()
-            cur_seq_specs.length = length
-            
-            problem = is_trna.istRNA(seq, input_fasta.id)
-            if problem != "":
-                self.stats_dict[problem] += 1
-                self.stats_dict['total_rejected'] += 1
+        for results in chunk_results:
+            for pos, cur_seq_specs in results:
+                table_for_tRNA_seqs.add_sequence('%s_%d' % (self.sample_name, pos), cur_seq_specs)
+                self.anticodon_summary[cur_seq_specs.gen_anticodon_summary_key()] += 1
+
+            t, p = self.stats_dict['total_seqs'], self.stats_dict['total_passed']
+            if num_input_reads:
+                self.progress.update('%.1f%% done :: %s :: %s of %s (num tRNAs :: num raw reads so far of all) ...' %\
+                                        (t * 100 / num_input_reads, pp(p), pp(t), pp(num_input_reads)))
             else:
-                #trying to determine length of trailer
-                for i in range(length - sub_size + 1):
-                    sub_str = seq[-(i + sub_size):(length - i)]
-                    missed = []
-                    for position_tuple in t_loop_guidelines[0]:
-                        if sub_str[position_tuple[0]] != position_tuple[1]:
-                            missed.append(position_tuple)
-                    if len(missed) < t_loop_guidelines[1] + 1:
-                        for elem in missed:
-                            self.stats_dict[str(elem)] += 1
-                        if len(missed) == 0:
-                            self.stats_dict['no_divergence']
-                        cur_seq_specs.seq = seq
-                        cur_seq_specs.seq_sub = sub_str
-                        cur_seq_specs.t_loop_seq = sub_str[0:9]
-                        cur_seq_specs.acceptor_seq = sub_str[-3:]
-                        cur_seq_specs = self.handle_pass_seq(cur_seq_specs, i)
-                        results_buffer.append(('%s_%d' % (self.sample_name, input_fasta.pos), cur_seq_specs))
-                        break
-
-
-
-            if sys.getsizeof(results_buffer) > memory_max:
-                self.progress.update('Writing %d items in the buffer to the DB ...' % len(results_buffer))
-                table_for_tRNA_seqs.append_sequences(results_buffer)
-                results_buffer = []
-
-            if self.stats_dict['total_seqs'] % 1000 == 0:
-                t, p = self.stats_dict['total_seqs'], self.stats_dict['total_passed']
                 self.progress.update('%s :: %s (num tRNAs :: num raw reads so far): %.2f%% ...' %\
                                         (pp(p), pp(t), p * 100 / t))
 
-        self.progress.update('Writing %d items in the buffer to the DB ...' % len(results_buffer))
-        table_for_tRNA_seqs.append_sequences(results_buffer)
-        results_buffer = []
+        self.progress.update('Writing %d items in the buffer to the DB ...' % len(table_for_tRNA_seqs.buffer))
+        table_for_tRNA_seqs.flush()
 
         # essentially we are done here. let's populate the stats table:
-        profile_db = dbops.tRNADatabase(self.output_db_path)
         self.progress.update('Writing stats ...')
-        for key in self.stats_dict:
-            profile_db.db.set_stat_value(key, self.stats_dict[key])
-        profile_db.disconnect()
+        table_for_tRNA_seqs.store_anticodon_summary(self.anticodon_summary)
+        table_for_tRNA_seqs.store_stats(self.stats_dict)
+        table_for_tRNA_seqs.close()
+        self.rejected_sink.close()
 
         self.progress.end()
 
@@ -324,7 +561,43 @@ class Sorter:
         self.run.info('Total raw seqs processed', self.stats_dict['total_seqs'])
         self.run.info('Total tRNA seqs recovered', self.stats_dict['total_passed'])
         self.run.info('Total full length tRNA seqs', self.stats_dict['total_full_length'])
+        if self.dereplicate and self.num_threads == 1:
+            self.run.info('Dereplication cache', '%s distinct seqs (%s evicted)' % (pp(len(self.classification_cache)),
+                                                                                    pp(self.num_classification_cache_evictions)))
+        self.run.info('Peak write buffer size', '%s (%d flushes)' % (utils.human_readable_file_size(table_for_tRNA_seqs.peak_buffer_bytes),
+                                                                    table_for_tRNA_seqs.num_flushes))
         self.run.info('Output DB path', self.output_db_path)
         self.run.info('Bye', terminal.get_date(), mc='green')
 
         self.run.quit()
+
+
+# the worker processes of `Sorter.classify_chunks_in_parallel` each keep their own
+# sorter instance around to classify the chunks they receive.
+_worker_sorter = None
+_worker_rejected = None
+
+
+def _init_worker(args, collect_rejected):
+    global _worker_sorter, _worker_rejected
+
+    _worker_sorter = Sorter(args)
+
+    # the parent process has already checked the size, and each worker gets
+    # an equal share of the part of it that goes to dereplication caches
+    _worker_sorter.set_memory_budgets(utils.get_num_bytes_from_human_readable(_worker_sorter.max_memory), _worker_sorter.num_threads)
+    _worker_rejected = sinks.RejectedReadsCollector() if collect_rejected else None
+    _worker_sorter.init_filters(_worker_rejected or sinks.RejectedReadsSink())
+
+
+def _classify_chunk(chunk):
+    """Classifies a chunk in a worker process, and returns the results along
+    with the stats and the rejected seqs that were collected for this chunk only."""
+    _worker_sorter.stats_dict = collections.Counter()
+    _worker_sorter.extractor.reset_stats()
+
+    results = _worker_sorter.classify_chunk(chunk)
+
+    rejected = _worker_rejected.pop() if _worker_rejected else []
+
+    return results, _worker_sorter.stats_dict, _worker_sorter.extractor.extractor_stats, rejected
@@ -11,7 +11,7 @@ __maintainer__ = "A. Murat Eren"
 __email__ = "a.murat.erengmail.com"
 
 
-profile_db_version = 1
+profile_db_version = 3
 
 
 ###############################################################################
@@ -24,4 +24,33 @@ profile_db_version = 1
 # table schemas for tRNA profiling table
 profile_table_name      = "profile"
 profile_table_structure = ["ID",   "Seq" , "Three_trailer", "T_loop", "Acceptor", "Full_length", "Seq_length", "Trailer_length", "Anticodon"]
-profile_table_types     = ["text", "text",     "text"     ,  "text" ,   "text"  ,     "text"   ,    "int"    ,      "int"      ,   "text"   ]
+profile_table_types     = ["text", "text",     "text"     ,  "text" ,   "text"  ,     "int"    ,    "int"    ,      "int"      ,   "text"   ]
+
+# table schemas for the reads the filters reject. `Missed` is a comma-separated
+# list of the guidelines a read missed on its way to the filter that rejected it
+rejected_table_name      = "rejected"
+rejected_table_structure = ["Read_ID", "Seq" , "Filter", "Missed"]
+rejected_table_types     = [  "text" , "text",  "text" ,  "text" ]
+
+# table schemas for the number of seqs with each anticodon (the value of the
+# Anticodon column of the profile table, as is), full length flag, length, and
+# whether they have a trailer or not. it is rolled up while profiling, so
+# anticodon profiles don't have to go through the profile table
+anticodon_summary_table_name      = "anticodon_summary"
+anticodon_summary_table_structure = ["Anticodon", "Full_length", "Seq_length", "Has_trailer", "Count"]
+anticodon_summary_table_types     = [   "text"  ,     "int"    ,    "int"    ,     "int"    ,  "int" ]
+
+
+###############################################################################
+#
+#   INDEXES
+#
+###############################################################################
+
+
+# (index name, table name, columns, where clause) for each index. the query
+# CLIs only ever look at seqs without a trailer that have an anticodon, so the
+# profile table index only covers those. Three_trailer is NULL for all of them,
+# but having it in the index lets SQLite count anticodons from the index alone
+profile_db_indexes = [("profile_anticodon_index", profile_table_name, "Anticodon, Seq_length, Full_length, Three_trailer", "Three_trailer IS NULL AND Anticodon IS NOT NULL"),
+                      ("rejected_filter_index"  , rejected_table_name, "Filter", None)]
@@ -4,8 +4,8 @@
 """Lonely, helper functions that are broadly used and don't fit anywhere"""
 
 import os
+import sys
 import string
-import textwrap
 
 import tRNASeqTools.filesnpaths as filesnpaths
 
@@ -38,6 +38,48 @@ def check_sample_id(sample_id):
                                 digits, and the underscore character ('_')." % sample_id)
 
 
+def get_num_bytes_from_human_readable(size):
+    """Takes a size like '4G', '512M', '100k' or '1000' and returns it in bytes."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+    size = str(size).strip().upper()
+    if size.endswith('B'):
+        size = size[:-1]
+
+    multiplier = 1
+    if size and size[-1] in units:
+        multiplier = units[size[-1]]
+        size = size[:-1]
+
+    try:
+        num_bytes = int(float(size) * multiplier)
+    except ValueError:
+        raise ConfigError("'%s' is not a size this program understands. Please use something like\
+                            '512M' or '4G'." % size)
+
+    if num_bytes <= 0:
+        raise ConfigError("The size must be positive (you said '%s')." % size)
+
+    return num_bytes
+
+
+def get_approximate_size_in_bytes(*objects):
+    """Returns the total size of `objects` as sys.getsizeof sees them. Objects
+    are not followed into, so containers should be passed along with what is in
+    them. Objects (i.e., strings) that are shared are counted more than once, so
+    this errs on the safe side."""
+    return sum([sys.getsizeof(o) for o in objects])
+
+
+def human_readable_file_size(nbytes):
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(nbytes) < 1024.0 or unit == 'TB':
+            break
+        nbytes /= 1024.0
+
+    return "%.1f %s" % (nbytes, unit)
+
+
 def store_dict_as_TAB_delimited_file(d, output_path, headers=None, file_obj=None):
     if not file_obj and not os.access(os.path.dirname(os.path.abspath(output_path)), os.W_OK):
         raise ConfigError("The output file path '%s' is not writable..." % output_path)
@@ -72,28 +114,31 @@ def store_dict_as_TAB_delimited_file(d, output_path, headers=None, file_obj=None
     return output_path
 
 
-def store_dict_as_FASTA_file(d, output_file_path, report_unique_sequences=False, wrap_from=200):
+def wrap_sequence(seq, wrap_from=200):
+    """Breaks a seq into lines of `wrap_from` characters."""
+    if len(seq) <= wrap_from:
+        return seq
+
+    return '\n'.join([seq[i:i + wrap_from] for i in range(0, len(seq), wrap_from)])
+
+
+def store_sequences_as_FASTA_file(sequences, output_file_path, report_frequencies=False, wrap_from=200):
+    """Writes (seq_id, seq, props, frequency) tuples (i.e., the ones
+    `dbops.tRNADatabase.iter_sequences` yields) into a FASTA file as they come,
+    where `props` is a list of (name, value) tuples that go into the deflines.
+    Returns the number of seqs written."""
     filesnpaths.is_output_file_writable(output_file_path)
-    output = open(output_file_path, 'w')
 
-    props_h = sorted(list(list(d.values())[0]['props'].keys()))
+    num_sequences = 0
+    with open(output_file_path, 'w') as output:
+        for seq_id, seq, props, frequency in sequences:
+            defline = '|'.join(['%s:%s' % (key, value) for key, value in props])
+            if report_frequencies:
+                defline += '|frequency:%d' % frequency
 
-    if report_unique_sequences:
-        seqs_sorted_by_frequency = [x[1] for x in sorted([(len(d[seq]['ids']), seq) for seq in d], reverse=True)]
+            output.write('>%s %s\n%s\n' % (seq_id, defline, wrap_sequence(seq, wrap_from)))
+            num_sequences += 1
 
-        for seq in seqs_sorted_by_frequency:
-            frequency = len(d[seq]['ids'])
-            seq_id = d[seq]['ids'].pop()
-            output.write('>%s %s|frequency:%d\n' % (seq_id, '|'.join(['%s:%s' % (t[0], t[1]) for t in d[seq]['props'].items()]), frequency))
-            output.write('%s\n' % textwrap.fill(seq, wrap_from, break_on_hyphens=False))
-    else:
-        for seq in d:
-            props = '|'.join(['%s:%s' % (t[0], t[1]) for t in d[seq]['props'].items()])
-            for seq_id in d[seq]['ids']:
-                output.write('>%s %s\n' % (seq_id, props))
-                output.write('%s\n' % textwrap.fill(seq, wrap_from, break_on_hyphens=False))
-
-    output.close()
-    return True
+    return num_sequences
 
 
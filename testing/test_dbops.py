@@ -0,0 +1,215 @@
+# coding: utf-8
+import unittest as ut
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import tRNASeqTools.db as db
+import tRNASeqTools.dbops as dbops
+import tRNASeqTools.tables as t
+
+from tRNASeqTools.errors import ConfigError
+
+class MigrationTestCase(ut.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tempdir, "test.db")
+
+        # a version 1 profile database
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE self (key text, value text)")
+        conn.execute("CREATE TABLE stats (key text, value numeric)")
+        conn.execute("CREATE TABLE profile (ID text, Seq text, Three_trailer text, T_loop text, Acceptor text, Full_length text, Seq_length int, Trailer_length int, Anticodon text)")
+        conn.executemany("INSERT INTO self VALUES (?,?)", [("version", "1"), ("sample_name", "test")])
+        conn.executemany("INSERT INTO stats VALUES (?,?)", [("total_passed", 2)])
+        conn.executemany("INSERT INTO profile VALUES (?,?,?,?,?,?,?,?,?)", [("test_1", "ACGT", None, "GTTCG", "CCA", "True", "75", "0", "GAT"),
+                                                                            ("test_2", "ACGTA", "A", "GTTCG", "CCA", "False", "54", "1", None)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_old_version_is_refused(self):
+        with self.assertRaises(ConfigError):
+            dbops.tRNADatabase(self.db_path)
+
+    def test_migrate_v1_to_latest(self):
+        profile_db = db.DB(self.db_path, t.profile_db_version, ignore_version=True)
+        profile_db.upgrade(t.profile_db_version, dbops.profile_db_migrations)
+        profile_db.disconnect()
+
+        profile_db = dbops.tRNADatabase(self.db_path)
+        self.assertEqual(profile_db.db.get_version(), t.profile_db_version)
+        self.assertEqual(sorted(profile_db.db.get_all_rows_from_table(t.profile_table_name)),
+                         [("test_1", "ACGT", None, "GTTCG", "CCA", 1, 75, 0, "GAT"),
+                          ("test_2", "ACGTA", "A", "GTTCG", "CCA", 0, 54, 1, None)])
+        self.assertEqual(profile_db.get_rejected_reads(), [])
+        self.assertEqual([s[1] for s in profile_db.iter_sequences(True, None, None)], ["ACGT"])
+        self.assertEqual(sorted(profile_db.db.get_all_rows_from_table(t.anticodon_summary_table_name), key=str),
+                         [("GAT", 1, 75, 0, 1), (None, 0, 54, 1, 1)])
+        self.assertEqual(profile_db.gen_anticodon_profile(True, None, None, None), {"GAT": 1})
+        profile_db.disconnect()
+
+class RowIterationTestCase(ut.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tempdir, "test.db")
+        dbops.tRNADatabase(self.db_path).create(meta_values={'sample_name': 'test'})
+
+        self.profile_db = db.DB(self.db_path, t.profile_db_version)
+        self.rows = [("test_%d" % i, "ACGT", None, "GTTCG", "CCA", i % 2, 70 + i, 0, "GAT") for i in range(25)]
+        self.profile_db._exec_many("INSERT INTO profile VALUES (?,?,?,?,?,?,?,?,?)", self.rows)
+
+    def tearDown(self):
+        self.profile_db.disconnect()
+        shutil.rmtree(self.tempdir)
+
+    def test_iter_rows(self):
+        self.assertEqual(list(self.profile_db.iter_rows(t.profile_table_name, batch_size=4)), self.rows)
+        self.assertEqual(list(self.profile_db.iter_rows(t.profile_table_name, columns=["ID"], batch_size=4)), [(r[0], ) for r in self.rows])
+
+    def test_iter_rows_where(self):
+        rows = self.profile_db.iter_rows_where(t.profile_table_name, "Full_length = ? AND Seq_length < ?", (1, 80), batch_size=2)
+        self.assertEqual(list(rows), [r for r in self.rows if r[5] == 1 and r[6] < 80])
+
+class SequenceExportTestCase(ut.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tempdir, "test.db")
+        dbops.tRNADatabase(self.db_path).create(meta_values={'sample_name': 'test'})
+
+        profile_db = db.DB(self.db_path, t.profile_db_version)
+        profile_db._exec_many("INSERT INTO profile VALUES (?,?,?,?,?,?,?,?,?)",
+                              [("test_3", "CCCC", None, "GTTCG", "CCA", 0, 4, 0, "GAT"),
+                               ("test_1", "AAAA", None, "GTTCG", "CCA", 1, 4, 0, "TAC"),
+                               ("test_2", "CCCC", None, "GTTCG", "CCA", 0, 4, 0, "GAT"),
+                               ("test_4", "GGGG", "A", "GTTCG", "CCA", 0, 4, 1, "GAT")])
+        profile_db._exec_many("INSERT INTO stats VALUES (?,?)", [("total_passed", 4)])
+        dbops.build_anticodon_summary(profile_db)
+        profile_db.disconnect()
+
+        self.profile_db = dbops.tRNADatabase(self.db_path)
+
+    def tearDown(self):
+        self.profile_db.disconnect()
+        shutil.rmtree(self.tempdir)
+
+    def test_iter_sequences(self):
+        self.assertEqual([(s[0], s[3]) for s in self.profile_db.iter_sequences(False, None, None)],
+                         [("test_3", 1), ("test_1", 1), ("test_2", 1)])
+
+    def test_iter_unique_sequences(self):
+        self.assertEqual(list(self.profile_db.iter_sequences(False, None, None, unique=True)),
+                         [("test_3", "CCCC", [("Full_length", False), ("Anticodon", "GAT"), ("Acceptor", "CCA")], 2),
+                          ("test_1", "AAAA", [("Full_length", True), ("Anticodon", "TAC"), ("Acceptor", "CCA")], 1)])
+
+    def test_anticodon_profile(self):
+        self.assertEqual(self.profile_db.gen_anticodon_profile(False, None, None, None), {"GAT": 2, "TAC": 1})
+        self.assertEqual(self.profile_db.gen_anticodon_profile(False, None, None, "TAC,XXX"), {"TAC": 1})
+        self.assertEqual(self.profile_db.gen_anticodon_profile(False, None, None, "GAT') OR ('1'='1"), {})
+
+    def test_anticodon_summary(self):
+        self.assertEqual(sorted(self.profile_db.db.get_all_rows_from_table(t.anticodon_summary_table_name)),
+                         [("GAT", 0, 4, 0, 2), ("GAT", 0, 4, 1, 1), ("TAC", 1, 4, 0, 1)])
+        self.assertEqual(self.profile_db.gen_anticodon_profile(True, None, None, None), {"TAC": 1})
+        self.assertEqual(self.profile_db.gen_anticodon_profile(False, 5, None, None), {})
+        self.assertEqual(self.profile_db.gen_anticodon_profile(False, 4, 4, None), {"GAT": 2, "TAC": 1})
+
+    def test_subsequence_anticodons(self):
+        self.profile_db.db._exec_many("INSERT INTO profile VALUES (?,?,?,?,?,?,?,?,?)",
+                                      [("test_5", "CCC", None, "GTTCG", "CCA", 0, 3, 0, None),
+                                       ("test_6", "AAGG", None, "GTTCG", "CCA", 0, 4, 0, None),
+                                       ("test_7", "GGG", None, "GTTCG", "CCA", 0, 3, 0, None),
+                                       ("test_8", "ACCCCAAAA", None, "GTTCG", "CCA", 0, 9, 0, "TAC,GAT")])
+        self.assertEqual(list(self.profile_db.iter_subsequence_anticodons()), [("test_5", ["GAT", "TAC"]), ("test_7", ["GAT"])])
+
+    def test_gen_anticodon_profiles(self):
+        # more profiles with other sample names, and fewer GAT seqs
+        db_paths = [self.db_path]
+        for i in range(1, 4):
+            db_paths.append(os.path.join(self.tempdir, "test_%d.db" % i))
+            shutil.copy(self.db_path, db_paths[-1])
+            conn = sqlite3.connect(db_paths[-1])
+            conn.execute("UPDATE self SET value = ? WHERE key = 'sample_name'", ("test_%d" % i, ))
+            conn.execute("DELETE FROM profile WHERE rowid <= ?", (i, ))
+            conn.commit()
+            conn.close()
+
+            profile_db = db.DB(db_paths[-1], t.profile_db_version)
+            dbops.build_anticodon_summary(profile_db)
+            profile_db.disconnect()
+
+        expected = [("test", {"GAT": 2, "TAC": 1}), ("test_1", {"GAT": 1, "TAC": 1}), ("test_2", {"GAT": 1}), ("test_3", {})]
+        self.assertEqual(list(dbops.gen_anticodon_profiles(db_paths)), expected)
+        self.assertEqual(list(dbops.gen_anticodon_profiles(db_paths, num_threads=3)), expected)
+
+
+class ProfileTableTestCase(ut.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tempdir, "test.db")
+        dbops.tRNADatabase(self.db_path).create(meta_values={'sample_name': 'test'})
+        self.rejected = [("read_%d" % i, "ACGT" * (i % 5 + 1), "filter_%d" % (i % 3), ("GAT", ) if i % 2 else ()) for i in range(100)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def get_rejected_reads(self):
+        profile_db = dbops.tRNADatabase(self.db_path)
+        rejected = profile_db.get_rejected_reads()
+        profile_db.disconnect()
+        return [(read_id, seq, filter_name, tuple(missed)) for read_id, seq, filter_name, missed in rejected]
+
+    def test_buffer_stays_within_max_bytes(self):
+        table = dbops.TableFortRNASequences(self.db_path, max_buffer_bytes=2000)
+        for rejected in self.rejected:
+            table.add_rejected_sequence(*rejected)
+        table.close()
+
+        self.assertGreater(table.num_flushes, 5)
+        self.assertLessEqual(table.peak_buffer_bytes, 2000)
+        self.assertEqual(self.get_rejected_reads(), self.rejected)
+
+    def test_bulk_load_settings_are_restored(self):
+        table = dbops.TableFortRNASequences(self.db_path, max_buffer_rows=30)
+        cursor = table.profile_db.db.cursor
+        self.assertEqual(cursor.execute("PRAGMA journal_mode").fetchone()[0], "off")
+        self.assertEqual(cursor.execute("PRAGMA synchronous").fetchone()[0], 0)
+
+        for rejected in self.rejected:
+            table.add_rejected_sequence(*rejected)
+        table.store_stats({'total_seqs': len(self.rejected)})
+
+        # the settings are per connection, so they are checked right before
+        # the table disconnects
+        settings = []
+        disconnect = table.profile_db.disconnect
+        def check_settings_and_disconnect():
+            settings.append((cursor.execute("PRAGMA journal_mode").fetchone()[0], cursor.execute("PRAGMA synchronous").fetchone()[0]))
+            disconnect()
+        table.profile_db.disconnect = check_settings_and_disconnect
+        table.close()
+
+        self.assertEqual(settings, [("delete", 2)])
+        self.assertEqual(self.get_rejected_reads(), self.rejected)
+
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("SELECT value FROM stats WHERE key = 'total_seqs'").fetchone()[0], len(self.rejected))
+        conn.close()
+
+
+class SequenceFiltersTestCase(ut.TestCase):
+    def test_sequence_filters(self):
+        sequence_filters = dbops.get_sequence_filters(True, 70, 90, "GAT,TAC")
+        self.assertEqual(sequence_filters.where_clause, "Three_trailer IS NULL AND Anticodon IS NOT NULL AND Full_length = 1"
+                                                        " AND Seq_length >= ? AND Seq_length <= ? AND Anticodon IN (?,?)")
+        self.assertEqual(sequence_filters.summary_where_clause, "Has_trailer = 0 AND Anticodon IS NOT NULL AND Full_length = 1"
+                                                                " AND Seq_length >= ? AND Seq_length <= ? AND Anticodon IN (?,?)")
+        self.assertEqual(sequence_filters.values, (70, 90, "GAT", "TAC"))
+        self.assertIs(dbops.get_sequence_filters(True, 70, 90, "GAT,TAC"), sequence_filters)
+
+if __name__ == '__main__':
+    ut.main()
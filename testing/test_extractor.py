@@ -6,6 +6,7 @@ import os
 import subprocess
 import csv
 import shutil
+import random
 
 import tRNASeqTools.extractor as extractor
 
@@ -41,6 +42,49 @@ class ExtractorTestCase(ut.TestCase):
         result = self.extractor.extract_anticodon("GGGTGATTAGCTCAGCTGGGAGAGCACCTCCCTTACAAGGAGGGGGtCGGCGGTTCGATCCCGTCATCACCCACCA")
         self.assertEqual(result, ["TAC", "ACA"])
 
+    def test_find_anticodons(self):
+        random.seed(0)
+        for i in range(2000):
+            seq = "".join([random.choice("ACGTN") for j in range(random.randint(67, 120))])
+            for arms in [self.extractor.type_I_arms, self.extractor.type_II_arms]:
+                expected = []
+                for x, arm_start in arms:
+                    a_arm = seq[-arm_start:-(arm_start - extractor.ANTICODON_ARM_LENGTH)]
+                    if self.extractor.pair_check(a_arm) and self.extractor.get_anticodon(a_arm):
+                        expected.append((x, self.extractor.get_anticodon(a_arm)))
+                self.assertEqual(self.extractor.find_anticodons(seq, arms), expected)
+
+    def test_find_anticodons_in_non_ascii_seqs(self):
+        seq = "GGGTGATTAGCTCAGCTGGGAGAGCACCTCCCTTACAAGGAGGGGGTCGGCGGTTCGATCCCGTCATCACCCACCA"
+        for i in range(len(seq)):
+            for c in ["\u00e9", "\u2603"]:
+                mutated = seq[:i] + c + seq[i + 1:]
+                for arms in [self.extractor.type_I_arms, self.extractor.type_II_arms]:
+                    expected = []
+                    for x, arm_start in arms:
+                        a_arm = mutated[-arm_start:-(arm_start - extractor.ANTICODON_ARM_LENGTH)]
+                        if self.extractor.pair_check(a_arm) and self.extractor.get_anticodon(a_arm):
+                            expected.append((x, self.extractor.get_anticodon(a_arm)))
+                    self.assertEqual(self.extractor.find_anticodons(mutated, arms), expected)
+
+    def test_match_unassigned_sequences(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(tempdir, "TAB")
+            rows = [("1", "AAACCCGGGTTTAAACCCGG", "GAT"), ("2", "--CCCGGGTTTAAACCCGGGTT", "TAC"), ("3", "CCCGGGTTTAAACCC", ""),
+                    ("4", "ACGTACGTACGTACGTACGT", ""), ("5", "-TTTAAACCCGGGTT", "")]
+            with open(file_path, "w") as f:
+                f.write("ID\tSeq\tAnticodon\n" + "".join(["\t".join(row) + "\n" for row in rows]))
+
+            self.extractor.match_unassigned_sequences(file_path, 0, ["ID", "Seq", "Anticodon"])
+
+            with open(file_path) as f:
+                result = [(row["ID"], row["Anticodon"]) for row in csv.DictReader(f, delimiter="\t")]
+            self.assertEqual(result, [("1", "GAT"), ("2", "TAC"), ("3", "TAC"), ("4", ""), ("5", "TAC")])
+            self.assertEqual(self.extractor.extractor_stats.subseq_match, 3)
+        finally:
+            shutil.rmtree(tempdir)
+
     def test_fail_extract_anticodon(self):
         result = self.extractor.extract_anticodon("CGGGATGTAGCACAGTTGGCTAGCTCACCACGTTGGGACATGGAGGTCGGAAATTCGAGTCTTCTCATCCTGACCA")
         self.assertEqual(result, [])
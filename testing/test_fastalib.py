@@ -0,0 +1,181 @@
+# coding: utf-8
+import unittest as ut
+
+import io
+import os
+import gzip
+import shutil
+import tempfile
+
+import tRNASeqTools.fastalib as u
+
+FASTA = ">read_1 some description\nACGT\nacgt\n>read_2\nGGGG\n\n>read_3\nTTTT\n"
+
+class FastaRecordsTestCase(ut.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_fasta_records(self):
+        expected = [("read_1 some description", "ACGTacgt"), ("read_2", "GGGG"), ("read_3", "TTTT")]
+        for block_size in [1, 2, 5, 1024]:
+            records = list(u.fasta_records(io.StringIO(FASTA), block_size=block_size))
+            self.assertEqual(records, expected)
+
+    def test_quality_records(self):
+        records = list(u.fasta_records(io.StringIO(">read_1\n30 30\n 20\n>read_2\n10\n"), separator=' '))
+        self.assertEqual(records, [("read_1", "30 30 20"), ("read_2", "10")])
+
+    def test_plain_and_gzip_sources_are_identical(self):
+        plain_path = os.path.join(self.tempdir, "reads.fa")
+        gzip_path = plain_path + ".gz"
+        with open(plain_path, "w") as f:
+            f.write(FASTA)
+        with gzip.open(gzip_path, "wt") as f:
+            f.write(FASTA)
+
+        plain = list(u.SequenceSource(plain_path).iter_records())
+        compressed = list(u.SequenceSource(gzip_path).iter_records())
+        self.assertEqual(plain, [(1, "read_1 some description", "ACGTACGT"), (2, "read_2", "GGGG"), (3, "read_3", "TTTT")])
+        self.assertEqual(plain, compressed)
+
+    def test_count_records(self):
+        plain_path = os.path.join(self.tempdir, "reads.fa")
+        gzip_path = plain_path + ".gz"
+        with open(plain_path, "w") as f:
+            f.write(FASTA)
+        with gzip.open(gzip_path, "wt") as f:
+            f.write(FASTA)
+
+        for block_size in [1, 2, 5, 1024]:
+            self.assertEqual(u.count_in_file(plain_path, b"\n>", block_size=block_size), 2)
+            self.assertEqual(u.count_in_file(gzip_path, b"\n>", block_size=block_size), 2)
+
+        self.assertEqual(u.count_records(plain_path), 3)
+        self.assertEqual(u.count_records(gzip_path), 3)
+        self.assertEqual(u.SequenceSource(plain_path, lazy_init=False).total_seq, 3)
+
+        # a file that changed is counted again
+        with open(plain_path, "a") as f:
+            f.write(">read_4\nCCCC\n")
+        self.assertEqual(u.count_records(plain_path), 4)
+
+    def test_get_seq_by_read_id(self):
+        fasta_path = os.path.join(self.tempdir, "reads.fa")
+        with open(fasta_path, "w") as f:
+            f.write(FASTA)
+
+        fasta = u.SequenceSource(fasta_path)
+        self.assertEqual(fasta.get_seq_by_read_id("read_3"), "TTTT")
+        self.assertEqual(fasta.get_seq_by_read_id("read_2"), "GGGG")
+        self.assertFalse(fasta.get_seq_by_read_id("read_4"))
+
+
+    def test_fasta_index(self):
+        fasta_path = os.path.join(self.tempdir, "reads.fa")
+        with open(fasta_path, "w") as f:
+            f.write(FASTA + ">read_4\n>read_2\nCCCC\n")
+
+        fasta = u.SequenceSource(fasta_path)
+        self.assertEqual(fasta.get_seqs_by_read_ids(["read_3", "read_1 some description", "read_4", "read_2", "read_5"]),
+                         {"read_1 some description": "ACGTACGT", "read_2": "GGGG", "read_3": "TTTT", "read_4": ""})
+        self.assertTrue(os.path.exists(fasta_path + u.FASTA_INDEX_SUFFIX))
+        fasta.close()
+
+        # an existing index is picked up by single lookups too
+        fasta = u.SequenceSource(fasta_path, allow_mixed_case=True)
+        self.assertEqual(fasta.get_seq_by_read_id("read_1 some description"), "ACGTacgt")
+        self.assertFalse(fasta.get_seq_by_read_id("read_5"))
+        self.assertIsNotNone(fasta.fasta_index)
+        fasta.close()
+
+    def test_unique_backends(self):
+        fasta_path = os.path.join(self.tempdir, "reads.fa")
+        with open(fasta_path, "w") as f:
+            for i, seq in enumerate(["ACGT", "GGGG", "acgt", "TTTT", "GGGG", "ACGT", "CCCC", "TTTT"]):
+                f.write(">read_%d\n%s\n" % (i + 1, seq))
+
+        def dereplicate(**kwargs):
+            fasta = u.SequenceSource(fasta_path, unique=True, **kwargs)
+            entries = []
+            while next(fasta):
+                entries.append((fasta.id, fasta.seq, list(fasta.ids)))
+            fasta.close()
+            return entries
+
+        expected = dereplicate()
+        self.assertEqual([(seq, len(ids)) for id, seq, ids in expected], [("ACGT", 3), ("TTTT", 2), ("GGGG", 2), ("CCCC", 1)])
+
+        positions = [(id, seq, [int(read_id.split("_")[1]) for read_id in ids]) for id, seq, ids in expected]
+        self.assertEqual(dereplicate(unique_backend="compact"), positions)
+        self.assertEqual(dereplicate(unique_backend="compact", max_unique_bytes_in_memory=500, spill_dir=self.tempdir), positions)
+        self.assertEqual(os.listdir(self.tempdir), ["reads.fa"])
+
+    def test_unique_sequences_spill_within_budget(self):
+        unique_sequences = u.UniqueSequences(max_bytes_in_memory=2000, spill_dir=self.tempdir)
+        peak_bytes = 0
+        for i in range(200):
+            unique_sequences.add("read_%d" % i, "ACGT" * (i % 7 + 1), i)
+            peak_bytes = max(peak_bytes, unique_sequences.entries_bytes)
+        unique_sequences.finalize()
+
+        self.assertGreater(unique_sequences.num_spills, 1)
+        self.assertLessEqual(peak_bytes, 2000)
+        self.assertEqual(len(unique_sequences), 7)
+        self.assertEqual(sorted([len(positions) for read_id, seq, positions in unique_sequences.iter_by_frequency()]), [28] * 3 + [29] * 4)
+        unique_sequences.close()
+
+
+FASTQ = "@read_1\nACGTACGT\n+\nIIIIII##\n@read_2\nGGGG\n+read_2\n####\n@read_3\nttTT\n+\nIIII\n"
+
+class FastqSourceTestCase(ut.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fastq_path = os.path.join(self.tempdir, "reads.fq")
+        with open(self.fastq_path, "w") as f:
+            f.write(FASTQ)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_fastq_records(self):
+        expected = [("read_1", "ACGTACGT", "IIIIII##"), ("read_2", "GGGG", "####"), ("read_3", "ttTT", "IIII")]
+        for block_size in [1, 3, 1024]:
+            records = list(u.fastq_records(io.StringIO(FASTQ), block_size=block_size))
+            self.assertEqual(records, expected)
+
+    def test_truncated_fastq(self):
+        with self.assertRaises(u.FastaLibError):
+            list(u.fastq_records(io.StringIO(FASTQ + "@read_4\nACGT\n")))
+
+    def test_get_sequence_file_format(self):
+        self.assertEqual(u.get_sequence_file_format(self.fastq_path), "fastq")
+
+    def test_fastq_source(self):
+        fastq = u.FastqSource(self.fastq_path)
+        self.assertTrue(next(fastq))
+        self.assertEqual(fastq.quals_int, [40] * 6 + [2] * 2)
+        self.assertEqual(list(fastq.iter_records()), [(2, "read_2", "GGGG"), (3, "read_3", "TTTT")])
+
+    def test_phred_offset(self):
+        fastq = u.FastqSource(self.fastq_path, phred_offset=64)
+        self.assertTrue(next(fastq))
+        self.assertEqual(fastq.quals_int, [9] * 6 + [-29] * 2)
+        self.assertTrue(next(fastq))
+        self.assertEqual(fastq.quals_int, [-29] * 4)
+
+        fastq = u.FastqSource(self.fastq_path, quality_filter=u.QualityFilter(phred_offset=64))
+        self.assertTrue(next(fastq))
+        self.assertEqual(fastq.quals_int, [9] * 6 + [-29] * 2)
+
+    def test_quality_filter(self):
+        quality_filter = u.QualityFilter(trim_quality=20, min_mean_quality=30)
+        fastq = u.FastqSource(self.fastq_path, quality_filter=quality_filter)
+        self.assertEqual(list(fastq.iter_records()), [(1, "read_1", "ACGTAC"), (2, "read_2", None), (3, "read_3", "TTTT")])
+
+
+if __name__ == "__main__":
+    suite = ut.TestLoader().loadTestsFromTestCase(FastaRecordsTestCase)
+    ut.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,30 @@
+# coding: utf-8
+import unittest as ut
+
+import os
+import gzip
+import shutil
+import tempfile
+
+import tRNASeqTools.filesnpaths as filesnpaths
+
+class NumLinesTestCase(ut.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_get_num_lines_in_file(self):
+        for contents, num_lines in [("a\nb\nc\n", 3), ("a\nb\nc", 3), ("\n", 1), ("", 0)]:
+            plain_path = os.path.join(self.tempdir, "lines.txt")
+            with open(plain_path, "w") as f:
+                f.write(contents)
+            with gzip.open(plain_path + ".gz", "wt") as f:
+                f.write(contents)
+
+            self.assertEqual(filesnpaths.get_num_lines_in_file(plain_path), num_lines)
+            self.assertEqual(filesnpaths.get_num_lines_in_file(plain_path + ".gz"), num_lines)
+
+if __name__ == '__main__':
+    ut.main()
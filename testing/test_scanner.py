@@ -0,0 +1,43 @@
+# coding: utf-8
+import unittest as ut
+
+import os
+
+import tRNASeqTools.fastalib as u
+import tRNASeqTools.filters as filters
+import tRNASeqTools.scanner as scanner
+
+TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class ScannerTestCase(ut.TestCase):
+    def setUp(self):
+        self.is_trna = filters.IsTRNA()
+        self.scanner = scanner.TLoopAndAcceptorScanner(self.is_trna.get_t_loop_and_acceptor_guidelines())
+
+    def test_pass_scan(self):
+        result = self.scanner.scan(["AACCGTTGAACTGAAAGGTTCCTGGGGTTCGAATCCCCATCTCTCCGCCA", "GGGGTTCGAATCCCCATCTCTCCGCCAAG"])
+        self.assertEqual(result, [filters.WindowMatch(True, 0, [], "GTTCGAATC", "CCA"),
+                                  filters.WindowMatch(True, 2, [], "GTTCGAATC", "CCA")])
+
+    def test_fail_scan(self):
+        result = self.scanner.scan(["GAGTACCAAGATCGGAAGAGCACACGTCTAGTTCTACAGTCCGACGATCATCCTTTGG", "ACGT"])
+        self.assertFalse(result[0].passed)
+        self.assertEqual(result[1], filters.NO_WINDOW_MATCH)
+
+    def test_scan_is_identical_to_find_t_loop_and_acceptor(self):
+        fasta = u.SequenceSource(os.path.join(TESTING_DIR, "sandbox", "raw_tRNA_sequences.fa"))
+        seqs = [seq for pos, read_id, seq in fasta.iter_records()]
+
+        self.assertEqual(self.scanner.scan(seqs), [self.is_trna.find_t_loop_and_acceptor(seq) for seq in seqs])
+
+    def test_scan_non_ascii_seqs(self):
+        seq = "AACCGTTGAACTGAAAGGTTCCTGGGGTTCGAATCCCCATCTCTCCGCCA"
+        seqs = [seq[:i] + "\u00e9" + seq[i + 1:] for i in range(len(seq))] + [seq[:-2] + "\u00e9\u2603"]
+        result = self.scanner.scan(seqs)
+        self.assertEqual(result, [self.is_trna.find_t_loop_and_acceptor(s) for s in seqs])
+        self.assertFalse(result[-1].passed)
+
+
+if __name__ == "__main__":
+    suite = ut.TestLoader().loadTestsFromTestCase(ScannerTestCase)
+    ut.TextTestRunner(verbosity=2).run(suite)
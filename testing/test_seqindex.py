@@ -0,0 +1,39 @@
+# coding: utf-8
+import unittest as ut
+
+import random
+
+import tRNASeqTools.seqindex as seqindex
+
+class SubsequenceIndexTestCase(ut.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.sequences = ["".join([random.choice("ACGT") for j in range(random.randint(0, 90))]) for i in range(300)]
+        self.index = seqindex.SubsequenceIndex(self.sequences, k=4, step=3)
+
+    def find(self, seq):
+        return [i for i, s in enumerate(self.sequences) if seq in s]
+
+    def test_find(self):
+        queries = ["", "A", "ACG", "ACGTAC"]
+        for i in range(2000):
+            seq = random.choice(self.sequences)
+            start = random.randint(0, len(seq))
+            queries.append(seq[start:start + random.randint(0, 30)])
+            queries.append("".join([random.choice("ACGT") for j in range(random.randint(5, 8))]))
+
+        for seq in queries:
+            self.assertEqual(self.index.find(seq), self.find(seq))
+
+    def test_find_many(self):
+        queries = [self.sequences[0][2:20], "ACGTAC", self.sequences[0][2:20]]
+        self.assertEqual(list(self.index.find_many(queries)), [self.find(seq) for seq in queries])
+
+    def test_no_match_across_seqs(self):
+        index = seqindex.SubsequenceIndex(["AAAAACCCCC", "GGGGGTTTTT"], k=2, step=2)
+        self.assertEqual(index.find("CCCCCGGGGG"), [])
+        self.assertEqual(index.find("CCCC\nGGGG"), [])
+        self.assertEqual(index.find("AACCCCC"), [0])
+
+if __name__ == '__main__':
+    ut.main()
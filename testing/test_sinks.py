@@ -0,0 +1,71 @@
+# coding: utf-8
+import unittest as ut
+
+import os
+import gzip
+import shutil
+import tempfile
+
+import tRNASeqTools.sinks as sinks
+import tRNASeqTools.dbops as dbops
+
+class FASTARejectedReadsSinkTestCase(ut.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.rejected = [("read_1", "ACGT", "filter_1", ()), ("read_2", "GGGG", "filter_2", ("guideline_1", )),
+                         ("read_3", "TTTT", "filter_1", ("guideline_1", "guideline_2"))]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_fasta(self):
+        # a tiny block size makes sure buffers get flushed in between writes too
+        sink = sinks.FASTARejectedReadsSink(self.tempdir, block_size=5)
+        sink.open(["filter_1", "filter_2", "filter_3"])
+        for rejected in self.rejected:
+            sink.write(*rejected)
+        sink.close()
+
+        self.assertEqual(open(os.path.join(self.tempdir, "filter_1")).read(), "read_1\nACGT\nread_3\nTTTT\n")
+        self.assertEqual(open(os.path.join(self.tempdir, "filter_2")).read(), "read_2\nGGGG\n")
+        self.assertEqual(open(os.path.join(self.tempdir, "filter_3")).read(), "")
+        self.assertEqual(open(os.path.join(self.tempdir, "guideline_1")).read(), "read_2\nGGGG\nread_3\nTTTT\n")
+        self.assertEqual(open(os.path.join(self.tempdir, "guideline_2")).read(), "read_3\nTTTT\n")
+
+    def test_fasta_gz(self):
+        sink = sinks.get_rejected_reads_sink('fasta.gz', self.tempdir)
+        sink.open(["filter_1"])
+        for rejected in self.rejected:
+            sink.write(*rejected)
+        sink.close()
+
+        self.assertEqual(gzip.open(os.path.join(self.tempdir, "filter_1.gz"), 'rt').read(), "read_1\nACGT\nread_3\nTTTT\n")
+        self.assertEqual(gzip.open(os.path.join(self.tempdir, "filter_2.gz"), 'rt').read(), "read_2\nGGGG\n")
+
+    def test_db(self):
+        db_path = os.path.join(self.tempdir, "test.db")
+        dbops.tRNADatabase(db_path).create(meta_values={'sample_name': 'test'})
+
+        # a buffer of two rows makes sure it gets flushed in between writes too
+        table = dbops.TableFortRNASequences(db_path, max_buffer_rows=2)
+        sink = sinks.get_rejected_reads_sink('db', profile_table=table)
+        for rejected in self.rejected:
+            sink.write(*rejected)
+        sink.close()
+        table.store_stats({'total_seqs': 3})
+        table.close()
+
+        profile_db = dbops.tRNADatabase(db_path)
+        self.assertEqual(profile_db.get_rejected_reads(), [(read_id, seq, filter_name, list(missed)) for read_id, seq, filter_name, missed in self.rejected])
+        self.assertEqual([r[0] for r in profile_db.get_rejected_reads(["filter_2"])], ["read_2"])
+        profile_db.disconnect()
+
+    def test_collector(self):
+        collector = sinks.RejectedReadsCollector()
+        for rejected in self.rejected:
+            collector.write(*rejected)
+        self.assertEqual(collector.pop(), self.rejected)
+        self.assertEqual(collector.pop(), [])
+
+if __name__ == '__main__':
+    ut.main()
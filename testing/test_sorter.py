@@ -4,8 +4,15 @@ import tempfile
 import subprocess
 import os
 import shutil
+import sqlite3
+import argparse
 
 import tRNASeqTools.sorter as sort
+import tRNASeqTools.sinks as sinks
+import tRNASeqTools.filters as filters
+import tRNASeqTools.fastalib as u
+
+TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
 
 class SortTestCase(ut.TestCase):
     def setUp(self):
@@ -73,6 +80,81 @@ class SortTestCase(ut.TestCase):
         finally:
             shutil.rmtree(tempdir)
 
+
+class ProcessTestCase(ut.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def profile(self, name, **kwargs):
+        output_db_path = os.path.join(self.tempdir, name, "profile.db")
+        os.makedirs(os.path.dirname(output_db_path))
+        args = argparse.Namespace(input_fasta=os.path.join(TESTING_DIR, "sandbox", "raw_tRNA_sequences.fa"),
+                                  sample_name="test_sample",
+                                  output_db_path=output_db_path,
+                                  **kwargs)
+        sort.Sorter(args).process()
+
+        conn = sqlite3.connect(output_db_path)
+        profile = sorted(conn.execute("SELECT * FROM profile").fetchall())
+        stats = sorted(conn.execute("SELECT * FROM stats").fetchall())
+        conn.close()
+        return profile, stats
+
+    def test_parallel_profile_is_identical_to_serial(self):
+        serial = self.profile("serial")
+        parallel = self.profile("parallel", num_threads=3, chunk_size=100)
+        self.assertEqual(serial, parallel)
+
+    def test_dereplicated_profile_is_identical_to_serial(self):
+        serial = self.profile("serial")
+        dereplicated = self.profile("dereplicated", dereplicate=True)
+        self.assertEqual(serial, dereplicated)
+
+class ClassificationCacheTestCase(ut.TestCase):
+    def classify_all(self, seqs, dereplicate=False, max_cache_bytes=None):
+        sorter = sort.Sorter(argparse.Namespace(dereplicate=dereplicate))
+        sorter.max_classification_cache_bytes = max_cache_bytes
+        sorter.init_filters(sinks.RejectedReadsSink())
+        results = [sorter.classify(seq, "read_%d" % i) for i, seq in enumerate(seqs)]
+        return sorter, [r.gen_sql_query_info_tuple("id") if r else None for r in results]
+
+    def test_capped_classification_cache(self):
+        fasta = u.SequenceSource(os.path.join(TESTING_DIR, "sandbox", "raw_tRNA_sequences.fa"))
+        seqs = [seq for pos, read_id, seq in fasta.iter_records()]
+        fasta.close()
+
+        sorter, expected = self.classify_all(seqs)
+        capped_sorter, results = self.classify_all(seqs, dereplicate=True, max_cache_bytes=20000)
+
+        self.assertEqual(results, expected)
+        self.assertEqual(capped_sorter.stats_dict, sorter.stats_dict)
+        self.assertGreater(capped_sorter.num_classification_cache_evictions, 0)
+        self.assertLessEqual(capped_sorter.classification_cache_bytes, 20000)
+
+    def test_memory_budgets_add_up_to_max_memory(self):
+        sorter = sort.Sorter(argparse.Namespace(dereplicate=True))
+        sorter.set_memory_budgets(1000001, num_processes=3)
+        self.assertLessEqual(sorter.max_write_buffer_bytes + 3 * sorter.max_classification_cache_bytes, 1000001)
+
+        sorter = sort.Sorter(argparse.Namespace(dereplicate=False))
+        sorter.set_memory_budgets(1000001)
+        self.assertEqual(sorter.max_write_buffer_bytes, 1000001)
+        self.assertIsNone(sorter.max_classification_cache_bytes)
+
+class PrecomputationsTestCase(ut.TestCase):
+    def test_precomputations_follow_the_guidelines(self):
+        is_trna = filters.IsTRNA()
+        self.assertEqual(is_trna.precomputations, [])
+
+        # acceptor stem matching, as 'Require_Acceptor_Stem_Matching_with_one_mismatch' sets it
+        is_trna.T_LOOP_AND_ACCEPTOR_GUIDELINES[2] = (True, 2)
+        is_trna.set_up_precomputations()
+        self.assertEqual(is_trna.precomputations, [is_trna.find_D_region_shift])
+
+
 if __name__ == "__main__":
     suite = ut.TestLoader().loadTestsFromTestCase(SortTestCase)
     ut.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,35 @@
+# coding: utf-8
+import unittest as ut
+
+import os
+import sys
+import json
+import subprocess
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that take long to import, and that the query programs do not need
+HEAVY_MODULES = ["pkg_resources", "numpy", "matplotlib", "multiprocessing.pool"]
+
+class StartupTestCase(ut.TestCase):
+    def get_imported_modules(self, modules):
+        code = "import sys, json; import %s; print(json.dumps(sorted(sys.modules)))" % ", ".join(modules)
+        env = dict(os.environ, PYTHONPATH=PACKAGE_DIR)
+        output = subprocess.check_output([sys.executable, "-c", code], env=env, cwd=PACKAGE_DIR)
+        return set(json.loads(output.decode("utf-8")))
+
+    def test_query_programs_do_not_import_heavy_modules(self):
+        # everything trna-get-db-info, trna-get-sequences and
+        # trna-gen-anticodon-profile import
+        imported = self.get_imported_modules(["tRNASeqTools", "tRNASeqTools.dbops", "tRNASeqTools.utils",
+                                              "tRNASeqTools.terminal", "tRNASeqTools.filesnpaths"])
+        self.assertIn("tRNASeqTools.dbops", imported)
+        self.assertEqual(sorted(imported.intersection(HEAVY_MODULES)), [])
+
+    def test_version(self):
+        env = dict(os.environ, PYTHONPATH=PACKAGE_DIR)
+        output = subprocess.check_output([sys.executable, "-c", "import tRNASeqTools; print(tRNASeqTools.__version__)"], env=env)
+        self.assertNotEqual(output.decode("utf-8").strip(), "unknown")
+
+if __name__ == '__main__':
+    ut.main()